@@ -0,0 +1,182 @@
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# psutil is optional: without it we fall back to /proc/meminfo and cgroup files
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def available_memory_mb():
+    """
+    Returns the memory still available to this container in MB, or None if unknown.
+    Takes the cgroup limit into account so Streamlit Cloud containers are measured correctly.
+    """
+    candidates = []
+
+    if psutil is not None:
+        try:
+            candidates.append(psutil.virtual_memory().available / (1024 * 1024))
+        except Exception:
+            pass
+    else:
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        candidates.append(int(line.split()[1]) / 1024)
+                        break
+        except (OSError, ValueError):
+            pass
+
+    # cgroup v2 limit (e.g. Docker / Streamlit Cloud)
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            limit = f.read().strip()
+        if limit != "max":
+            with open("/sys/fs/cgroup/memory.current") as f:
+                current = int(f.read().strip())
+            candidates.append((int(limit) - current) / (1024 * 1024))
+    except (OSError, ValueError):
+        pass
+
+    return round(min(candidates), 1) if candidates else None
+
+
+class FairPool:
+    """
+    A fixed number of slots handed out strictly in arrival order (FIFO).
+    Tracks how long slots are held so waiting callers can be given an ETA.
+    """
+
+    def __init__(self, name, capacity, initial_hold_s):
+        self.name = name
+        self.capacity = max(1, int(capacity))
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._free_slots = list(range(self.capacity))
+        self._active = {}
+        self._avg_hold_s = float(initial_hold_s)
+
+    def _eta_s(self, position):
+        """Estimated seconds until the caller at `position` (1-based) gets a slot."""
+        now = time.time()
+        remaining = sorted(
+            max(0.0, self._avg_hold_s - (now - started)) for started in self._active.values()
+        )
+        remaining += [0.0] * len(self._free_slots)
+        index = position - 1
+        return round(remaining[index % self.capacity] + (index // self.capacity) * self._avg_hold_s)
+
+    def acquire(self, on_wait=None, can_admit=None, poll_s=1.0):
+        """
+        Blocks until this caller is first in line, a slot is free and `can_admit()` allows it.
+        `on_wait(position, eta_s, reason)` is called outside the lock while waiting.
+        Returns the slot index.
+        """
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+
+        try:
+            while True:
+                with self._cond:
+                    first = self._queue[0] is ticket
+                    reason = None
+                    if not first:
+                        reason = "queued"
+                    elif not self._free_slots:
+                        reason = "all slots busy"
+                    elif can_admit is not None:
+                        reason = can_admit()
+
+                    if reason is None:
+                        self._queue.popleft()
+                        slot = self._free_slots.pop(0)
+                        self._active[slot] = time.time()
+                        self._cond.notify_all()
+                        return slot
+
+                    position = self._queue.index(ticket) + 1
+                    eta_s = self._eta_s(position)
+
+                if on_wait:
+                    on_wait(position, eta_s, reason)
+
+                with self._cond:
+                    self._cond.wait(timeout=poll_s)
+        except BaseException:
+            # Leaving the queue (error, rerun, cancellation) must not block the people behind us
+            with self._cond:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                self._cond.notify_all()
+            raise
+
+    def release(self, slot):
+        """Returns a slot to the pool and updates the average hold time."""
+        with self._cond:
+            started = self._active.pop(slot, None)
+            if started is not None:
+                held = time.time() - started
+                # Exponential moving average keeps the ETA responsive to recent runs
+                self._avg_hold_s = 0.7 * self._avg_hold_s + 0.3 * held
+            self._free_slots.append(slot)
+            self._free_slots.sort()
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, on_wait=None, can_admit=None):
+        slot = self.acquire(on_wait=on_wait, can_admit=can_admit)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    def status(self):
+        with self._cond:
+            return {
+                "active": len(self._active),
+                "capacity": self.capacity,
+                "queued": len(self._queue),
+                "avg_hold_s": round(self._avg_hold_s, 1),
+            }
+
+
+class AdmissionController:
+    """
+    Process-wide limits shared by every Streamlit session:
+    live Chrome browsers, in-flight LLM requests, and a free-memory floor
+    below which no new browser is started.
+    """
+
+    def __init__(self, max_browsers=2, max_llm_requests=4, min_free_memory_mb=600):
+        self.browsers = FairPool("browser", max_browsers, initial_hold_s=90)
+        self.llm = FairPool("llm", max_llm_requests, initial_hold_s=8)
+        self.min_free_memory_mb = min_free_memory_mb
+
+    def _memory_backpressure(self):
+        """Returns a reason string while memory is too low to start another browser."""
+        # Never block the only browser: with nothing running, waiting frees no memory
+        if self.browsers.status()["active"] == 0:
+            return None
+        free_mb = available_memory_mb()
+        if free_mb is not None and free_mb < self.min_free_memory_mb:
+            return f"low memory ({free_mb:.0f} MB free)"
+        return None
+
+    def browser_slot(self, on_wait=None):
+        return self.browsers.slot(on_wait=on_wait, can_admit=self._memory_backpressure)
+
+    def llm_slot(self, on_wait=None):
+        return self.llm.slot(on_wait=on_wait)
+
+    def status(self):
+        return {
+            "browsers": self.browsers.status(),
+            "llm": self.llm.status(),
+            "free_memory_mb": available_memory_mb(),
+        }
@@ -0,0 +1,159 @@
+import time
+import uuid
+import queue
+import threading
+from contextlib import contextmanager
+
+
+class BatchCancelled(BaseException):
+    """
+    Raised inside the worker when the user cancels the batch.
+    A BaseException so the automation's broad `except Exception` blocks don't swallow it.
+    """
+
+
+class BatchChannel:
+    """
+    Thread-safe channel between a background batch and the Streamlit UI.
+
+    The worker calls the same methods it would call on `st` (info, write,
+    success, ...); they are queued as events instead of rendered. The UI
+    drains the queue on each poll and renders the per-guest status table.
+    """
+
+    def __init__(self, batch_id=None):
+        self.batch_id = batch_id
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self.log = []
+        self.guests = {}
+        self.results = {}
+        self.status_line = ""
+        self.state = "queued"
+        self.started_at = time.time()
+        self.finished_at = None
+
+    # --- worker side ---
+    def _emit(self, kind, body=None, **extra):
+        self._events.put({"kind": kind, "body": body, "at": time.time(), **extra})
+
+    def info(self, body, **kwargs):
+        self._emit("info", body)
+
+    def write(self, body, **kwargs):
+        self._emit("write", body)
+
+    def success(self, body, **kwargs):
+        self._emit("success", body)
+
+    def warning(self, body, **kwargs):
+        self._emit("warning", body)
+
+    def error(self, body, **kwargs):
+        self._emit("error", body)
+
+    def toast(self, body, **kwargs):
+        self._emit("write", body)
+
+    def markdown(self, body, **kwargs):
+        self._emit("markdown", body)
+
+    def code(self, body, **kwargs):
+        self._emit("code", body)
+
+    def image(self, path, caption=None, **kwargs):
+        self._emit("image", path, caption=caption)
+
+    def dataframe(self, data, **kwargs):
+        self._emit("dataframe", data)
+
+    def divider(self):
+        pass
+
+    def balloons(self):
+        pass
+
+    @contextmanager
+    def expander(self, label, **kwargs):
+        self._emit("write", label)
+        yield self
+
+    def update_guest(self, key, stage, detail=""):
+        """Sets the compact live status of one guest (e.g. reading / saving / saved)."""
+        self._emit("guest", detail, key=key, stage=stage)
+
+    def set_status(self, text):
+        """One-line batch status (queue position, portal pauses, ...)."""
+        self._emit("status", text)
+
+    def set_result(self, name, value):
+        self._emit("result", value, name=name)
+
+    def set_state(self, state):
+        self._emit("state", state)
+
+    def check_cancelled(self):
+        """Called by the worker between steps; aborts the batch if the user cancelled."""
+        if self._cancel.is_set():
+            raise BatchCancelled()
+
+    # --- UI side ---
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    @property
+    def running(self):
+        return self.state in ("queued", "running")
+
+    def poll(self):
+        """Drains pending events into the channel's state. Returns the new log events."""
+        new_events = []
+        while True:
+            try:
+                event = self._events.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                if event["kind"] == "guest":
+                    self.guests[event["key"]] = {"stage": event["stage"], "detail": event["body"]}
+                elif event["kind"] == "status":
+                    self.status_line = event["body"]
+                elif event["kind"] == "result":
+                    self.results[event["name"]] = event["body"]
+                elif event["kind"] == "state":
+                    self.state = event["body"]
+                    if not self.running:
+                        self.finished_at = event["at"]
+                else:
+                    self.log.append(event)
+                    new_events.append(event)
+        return new_events
+
+
+def start_batch(target, *args, **kwargs):
+    """
+    Runs `target(channel, *args, **kwargs)` on a daemon thread and returns
+    (batch_id, channel). UI reruns never touch the thread; they only poll.
+    `target` may return the final state (e.g. "failed"); it defaults to "finished".
+    """
+    batch_id = uuid.uuid4().hex[:8]
+    channel = BatchChannel(batch_id)
+
+    def _run():
+        channel.set_state("running")
+        try:
+            channel.set_state(target(channel, *args, **kwargs) or "finished")
+        except BatchCancelled:
+            channel.warning("🛑 Batch cancelled.")
+            channel.set_state("cancelled")
+        except Exception as e:
+            channel.error(f"Batch Error: {type(e).__name__} - {e}")
+            channel.set_state("failed")
+
+    threading.Thread(target=_run, name=f"batch-{batch_id}", daemon=True).start()
+    return batch_id, channel
@@ -0,0 +1,187 @@
+"""
+Benchmarks the local MRZ backend on a synthetic passport corpus drawn with Pillow.
+
+    python benchmark_mrz.py --count 200 --seed 7 --save output/mrz_corpus
+"""
+import io
+import os
+import time
+import random
+import string
+import argparse
+import datetime
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from passport_checks import mrz_check_digit
+from extractors import LocalMRZExtractor, ExtractionError
+
+SURNAMES = ["NGUYEN", "SMITH", "KIM", "MUELLER", "IVANOVA", "GARCIA LOPEZ", "DUBOIS", "TANAKA", "OBRIEN", "PETROV"]
+GIVEN_NAMES = ["ANNA MARIA", "JOHN", "MIN JUN", "LUKAS", "OLGA", "CARLOS", "CHLOE", "HARUTO", "SEAN PATRICK", "IVAN"]
+NATIONALITIES = ["USA", "KOR", "D", "GBR", "FRA", "AUS", "RUS", "CHN", "JPN", "VNM", "ROM", "ESP"]
+MONO_FONTS = ["OCRB.ttf", "DejaVuSansMono.ttf", "LiberationMono-Regular.ttf", "Courier New.ttf", "cour.ttf"]
+
+
+def _font(size):
+    for name in MONO_FONTS:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size=size)
+
+
+def _mrz_date(date):
+    return date.strftime("%y%m%d")
+
+
+def build_td3_mrz(surname, given, number, nationality, dob, sex, expiry):
+    """Builds both TD3 lines with valid check digits."""
+    names = surname.replace(" ", "<") + "<<" + given.replace(" ", "<")
+    line1 = ("P<" + nationality.ljust(3, "<") + names).ljust(44, "<")[:44]
+
+    number = number.ljust(9, "<")
+    personal = "<" * 14
+    line2 = (
+        number + mrz_check_digit(number)
+        + nationality.ljust(3, "<")
+        + _mrz_date(dob) + mrz_check_digit(_mrz_date(dob))
+        + sex
+        + _mrz_date(expiry) + mrz_check_digit(_mrz_date(expiry))
+        + personal + mrz_check_digit(personal)
+    )
+    line2 += mrz_check_digit(line2[0:10] + line2[13:20] + line2[21:43])
+    return line1, line2
+
+
+def random_passport(rng):
+    dob = datetime.date(1940, 1, 1) + datetime.timedelta(days=rng.randint(0, 365 * 65))
+    expiry = datetime.date.today() + datetime.timedelta(days=rng.randint(30, 365 * 9))
+    record = {
+        "surname": rng.choice(SURNAMES),
+        "given": rng.choice(GIVEN_NAMES),
+        "passport_number": "".join(rng.choices(string.ascii_uppercase + string.digits, k=rng.choice([8, 9]))),
+        "nationality_code": rng.choice(NATIONALITIES),
+        "dob": dob,
+        "sex": rng.choice("FM"),
+        "expiry": expiry,
+    }
+    record["full_name"] = f"{record['surname']} {record['given']}"
+    return record
+
+
+def render_passport(record, rng):
+    """Draws a data page: header, printed fields, a photo box and the MRZ band."""
+    width, height = 1250, 880
+    image = Image.new("RGB", (width, height), (236, 232, 222))
+    draw = ImageDraw.Draw(image)
+
+    draw.text((40, 30), "PASSPORT / PASSEPORT", font=_font(36), fill=(40, 40, 90))
+    draw.rectangle((40, 110, 340, 500), outline=(120, 120, 120), fill=(200, 200, 205))
+    printed = [
+        ("Surname", record["surname"]),
+        ("Given names", record["given"]),
+        ("Nationality", record["nationality_code"]),
+        ("Date of birth", record["dob"].strftime("%d %b %Y").upper()),
+        ("Sex", record["sex"]),
+        ("Passport No.", record["passport_number"]),
+    ]
+    y = 120
+    for label, value in printed:
+        draw.text((380, y), label, font=_font(20), fill=(90, 90, 90))
+        draw.text((380, y + 24), value, font=_font(30), fill=(20, 20, 20))
+        y += 66
+
+    line1, line2 = build_td3_mrz(
+        record["surname"], record["given"], record["passport_number"],
+        record["nationality_code"], record["dob"], record["sex"], record["expiry"],
+    )
+    mrz_font = _font(26)
+    draw.text((40, height - 150), line1, font=mrz_font, fill=(10, 10, 10))
+    draw.text((40, height - 90), line2, font=mrz_font, fill=(10, 10, 10))
+
+    # Capture artefacts: slight rotation, blur, sensor noise and JPEG compression
+    image = image.rotate(rng.uniform(-1.5, 1.5), expand=True, fillcolor=(236, 232, 222))
+    if rng.random() < 0.5:
+        image = image.filter(ImageFilter.GaussianBlur(rng.uniform(0.3, 1.0)))
+    noise = Image.effect_noise(image.size, rng.uniform(5, 20)).convert("RGB")
+    image = Image.blend(image, noise, 0.08)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=rng.randint(60, 90))
+    return buffer.getvalue()
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def run_benchmark(count, seed, save_dir=None, min_confidence=0.85):
+    extractor = LocalMRZExtractor()
+    if not extractor.is_available():
+        raise SystemExit("Tesseract is not available: install `tesseract-ocr` and `pytesseract`.")
+
+    rng = random.Random(seed)
+    fields = ["full_name", "passport_number", "nationality_code", "dob", "sex"]
+    correct = {field: 0 for field in fields}
+    exact = confident = confident_exact = read = 0
+    latencies = []
+
+    if save_dir:
+        os.makedirs(save_dir, exist_ok=True)
+
+    for i in range(count):
+        record = random_passport(rng)
+        image_bytes = render_passport(record, rng)
+        if save_dir:
+            with open(os.path.join(save_dir, f"passport_{i:04d}.jpg"), "wb") as f:
+                f.write(image_bytes)
+
+        expected = {
+            "full_name": record["full_name"],
+            "passport_number": record["passport_number"],
+            "nationality_code": record["nationality_code"],
+            "dob": record["dob"].strftime("%d/%m/%Y"),
+            "sex": record["sex"],
+        }
+
+        started = time.perf_counter()
+        try:
+            data = extractor.extract(image_bytes)
+        except ExtractionError:
+            data = None
+        latencies.append(time.perf_counter() - started)
+        if data is None:
+            continue
+
+        read += 1
+        matches = {field: data.get(field) == expected[field] for field in fields}
+        for field, ok in matches.items():
+            correct[field] += ok
+        all_ok = all(matches.values())
+        exact += all_ok
+
+        confidence, _ = extractor.score(data, set(NATIONALITIES))
+        if confidence >= min_confidence:
+            confident += 1
+            confident_exact += all_ok
+
+    print(f"Images:                {count}")
+    print(f"MRZ read:              {read} ({read / count:.0%})")
+    print(f"All fields correct:    {exact} ({exact / count:.0%})")
+    for field in fields:
+        print(f"  {field:<20} {correct[field] / count:.0%}")
+    print(f"Confident (>= {min_confidence:.0%}):  {confident} ({confident / count:.0%}) -> no cloud call needed")
+    if confident:
+        print(f"Precision when confident: {confident_exact / confident:.1%}")
+    print(f"Latency mean / p95:    {sum(latencies) / count * 1000:.0f} ms / {_percentile(latencies, 0.95) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--save", help="Directory to write the generated images to")
+    args = parser.parse_args()
+    run_benchmark(args.count, args.seed, args.save)
@@ -0,0 +1,260 @@
+import os
+import re
+import json
+import time
+import threading
+
+from selenium import webdriver
+
+# psutil is optional: without it we still report JS heap numbers from DevTools
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Persistent profile/cache lives next to the app so it survives between runs
+PROFILE_ROOT = os.path.join("browser_profile")
+METRICS_LOG = os.path.join("output", "browser_metrics.jsonl")
+
+# DevTools resource types the portal never needs to fill the declaration form
+LEAN_BLOCKED_RESOURCE_TYPES = ["Image", "Font", "Media"]
+
+# Extension globs, only used if DevTools request interception can't be started
+LEAN_FALLBACK_URLS = [
+    # Images
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.bmp", "*.ico", "*.svg",
+    # Fonts
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    # Media
+    "*.mp4", "*.webm", "*.mp3", "*.ogg",
+]
+
+# Third-party hosts that only serve analytics, ads or web fonts
+LEAN_BLOCKED_HOSTS = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "facebook.net",
+    "facebook.com",
+    "fonts.googleapis.com",
+    "fonts.gstatic.com",
+    "youtube.com",
+    "ytimg.com",
+]
+
+
+def _profile_dir(listing_name, profile_slot=0):
+    """
+    Returns the persistent profile directory for a listing.
+    Chrome locks its profile, so each concurrent browser slot gets its own copy.
+    """
+    slug = re.sub(r'[^a-zA-Z0-9]+', '_', listing_name).strip('_').lower() or "default"
+    return os.path.abspath(os.path.join(PROFILE_ROOT, f"{slug}_{profile_slot}"))
+
+
+def build_chrome_options(headless_mode=True, lean_mode=False, listing_name="default", profile_slot=0):
+    """
+    Builds the Chrome options used by the automation.
+    Lean mode adds an eager page-load strategy, a persistent profile/disk cache
+    and disables image loading at the content-settings level.
+    """
+    options = webdriver.ChromeOptions()
+    # Keep browser open, except with the persistent lean profile: a detached
+    # browser would hold Chrome's profile lock and break the next run.
+    if not lean_mode:
+        options.add_experimental_option("detach", True)
+    if headless_mode:
+        options.add_argument("--headless")
+        options.add_argument("--window-size=1920,1080")
+
+    # Stability Flags for macOS/Linux
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--disable-extensions")
+    options.add_argument("--disable-infobars")
+
+    if lean_mode:
+        # Return from driver.get() once the DOM is ready; every step already
+        # uses an explicit WebDriverWait for the element it needs.
+        options.page_load_strategy = "eager"
+
+        profile_dir = _profile_dir(listing_name, profile_slot)
+        os.makedirs(profile_dir, exist_ok=True)
+        options.add_argument(f"--user-data-dir={profile_dir}")
+        options.add_argument(f"--disk-cache-dir={os.path.join(profile_dir, 'cache')}")
+        options.add_argument("--disk-cache-size=104857600") # 100 MB
+
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_argument("--disable-background-networking")
+        options.add_argument("--disable-component-update")
+        options.add_argument("--disable-default-apps")
+        options.add_argument("--disable-sync")
+        options.add_argument("--mute-audio")
+        options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+        })
+
+    return options
+
+
+def _intercept_resource_types(driver, ready):
+    """
+    Runs on a daemon thread for the browser's lifetime: pauses requests of the
+    blocked resource types via the DevTools Fetch domain and fails them.
+    """
+    import trio
+
+    async def _intercept():
+        async with driver.bidi_connection() as connection:
+            session, devtools = connection.session, connection.devtools
+            patterns = [
+                devtools.fetch.RequestPattern(
+                    url_pattern="*",
+                    resource_type=devtools.network.ResourceType(resource_type),
+                    request_stage=devtools.fetch.RequestStage.REQUEST,
+                )
+                for resource_type in LEAN_BLOCKED_RESOURCE_TYPES
+            ]
+            await session.execute(devtools.fetch.enable(patterns=patterns))
+            ready.set()
+            async for event in session.listen(devtools.fetch.RequestPaused):
+                await session.execute(devtools.fetch.fail_request(
+                    event.request_id, devtools.network.ErrorReason.BLOCKED_BY_CLIENT
+                ))
+
+    try:
+        trio.run(_intercept)
+    except Exception:
+        pass # The connection closes when the driver quits
+
+
+def enable_lean_network(driver):
+    """
+    Blocks non-essential resource types (Fetch interception by resourceType)
+    and known-irrelevant hosts through DevTools.
+    Returns True if the blocking rules were installed.
+    """
+    ready = threading.Event()
+    threading.Thread(target=_intercept_resource_types, args=(driver, ready), daemon=True).start()
+    intercepting = ready.wait(timeout=10)
+
+    patterns = []
+    for host in LEAN_BLOCKED_HOSTS:
+        patterns.append(f"*://{host}/*")
+        patterns.append(f"*://*.{host}/*")
+    if not intercepting:
+        print("Fetch interception unavailable, blocking by file extension instead")
+        patterns += LEAN_FALLBACK_URLS
+
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+        return True
+    except Exception as e:
+        print(f"Could not enable lean network rules: {e}")
+        return intercepting
+
+
+def _browser_rss_mb(driver):
+    """Sums the resident memory of the chromedriver process tree (needs psutil)."""
+    if psutil is None:
+        return None
+    try:
+        root = psutil.Process(driver.service.process.pid)
+        procs = [root] + root.children(recursive=True)
+        total = 0
+        for proc in procs:
+            try:
+                total += proc.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return round(total / (1024 * 1024), 1)
+    except Exception:
+        return None
+
+
+def collect_page_metrics(driver, step, lean_mode):
+    """
+    Reads navigation timing and memory numbers for the current page.
+    Returns a dict suitable for display and for the metrics log.
+    """
+    metrics = {
+        "timestamp": int(time.time()),
+        "step": step,
+        "lean_mode": bool(lean_mode),
+        "dom_ready_ms": None,
+        "load_ms": None,
+        "js_heap_mb": None,
+        "browser_rss_mb": _browser_rss_mb(driver),
+    }
+
+    try:
+        timing = driver.execute_script(
+            "var t = window.performance.timing;"
+            "return {start: t.navigationStart, dom: t.domContentLoadedEventEnd, load: t.loadEventEnd};"
+        )
+        if timing and timing.get("start"):
+            if timing.get("dom"):
+                metrics["dom_ready_ms"] = timing["dom"] - timing["start"]
+            if timing.get("load"):
+                metrics["load_ms"] = timing["load"] - timing["start"]
+    except Exception:
+        pass
+
+    try:
+        driver.execute_cdp_cmd("Performance.enable", {})
+        perf = driver.execute_cdp_cmd("Performance.getMetrics", {})
+        values = {m["name"]: m["value"] for m in perf.get("metrics", [])}
+        if "JSHeapUsedSize" in values:
+            metrics["js_heap_mb"] = round(values["JSHeapUsedSize"] / (1024 * 1024), 1)
+    except Exception:
+        pass
+
+    return metrics
+
+
+def save_page_metrics(metrics_list):
+    """Appends collected metrics to the local metrics log."""
+    if not metrics_list:
+        return
+    os.makedirs(os.path.dirname(METRICS_LOG), exist_ok=True)
+    with open(METRICS_LOG, "a", encoding="utf-8") as f:
+        for metrics in metrics_list:
+            f.write(json.dumps(metrics) + "\n")
+
+
+def summarize_page_metrics():
+    """
+    Averages the logged metrics per step with lean mode on and off,
+    so both profiles can be compared side by side.
+    """
+    if not os.path.exists(METRICS_LOG):
+        return []
+
+    buckets = {}
+    with open(METRICS_LOG, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            key = (row.get("step"), "on" if row.get("lean_mode") else "off")
+            buckets.setdefault(key, []).append(row)
+
+    def _avg(rows, field):
+        values = [r[field] for r in rows if r.get(field) is not None]
+        return round(sum(values) / len(values), 1) if values else None
+
+    summary = []
+    for (step, mode), rows in sorted(buckets.items()):
+        summary.append({
+            "step": step,
+            "lean_mode": mode,
+            "runs": len(rows),
+            "avg_dom_ready_ms": _avg(rows, "dom_ready_ms"),
+            "avg_load_ms": _avg(rows, "load_ms"),
+            "avg_js_heap_mb": _avg(rows, "js_heap_mb"),
+            "avg_browser_rss_mb": _avg(rows, "browser_rss_mb"),
+        })
+    return summary
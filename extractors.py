@@ -0,0 +1,372 @@
+import io
+import re
+import json
+import time
+import base64
+from contextlib import nullcontext
+
+from PIL import Image, ImageOps, ImageFilter
+
+from passport_checks import parse_td3_mrz, score_extraction, score_mrz_read
+
+# Cloud SDKs and the local OCR engine are optional: a backend whose
+# dependency is missing simply reports itself as unavailable.
+try:
+    import google.generativeai as genai
+except ImportError:
+    genai = None
+
+try:
+    from openai import OpenAI
+except ImportError:
+    OpenAI = None
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+# --- SHARED SCHEMA ---
+# Every backend returns these keys (plus "mrz" when it saw the MRZ)
+PASSPORT_SCHEMA = {
+    "full_name": "STRING (UPPERCASE)",
+    "passport_number": "STRING",
+    "nationality_code": "3-letter ISO code (e.g. BGR, USA, KOR)",
+    "dob": "DD/MM/YYYY",
+    "sex": "F or M",
+    "mrz": ["MRZ LINE 1 (44 chars)", "MRZ LINE 2 (44 chars)"],
+}
+
+EXTRACTION_PROMPT = f"""
+Analyze this passport image and extract data into strict JSON:
+{json.dumps(PASSPORT_SCHEMA, indent=2)}
+Copy the two machine readable zone lines exactly, including '<' fillers.
+Return ONLY the JSON. No markdown.
+"""
+
+
+class ExtractionError(Exception):
+    """Raised when a backend could not produce a usable result."""
+
+
+class ModelCompatibilityError(ExtractionError):
+    """Raised when none of the configured cloud models worked with the key."""
+
+
+def clean_and_parse_json(text_content):
+    """Parses the first {...} block of a model response."""
+    text_content = text_content.strip()
+    # Find first { and last }
+    match = re.search(r'(\{.*\})', text_content, re.DOTALL)
+    if match:
+        text_content = match.group(1)
+    return json.loads(text_content)
+
+
+class Extractor:
+    """
+    Base class for passport extraction backends.
+    `capabilities` tells the chain how a backend behaves (network use, cost, MRZ).
+    """
+
+    name = "base"
+    capabilities = {"network": False, "paid": False, "reads_mrz": False}
+
+    def is_available(self):
+        return True
+
+    def extract(self, image_bytes, log=None):
+        """Returns a dict following PASSPORT_SCHEMA or raises ExtractionError."""
+        raise NotImplementedError
+
+    def score(self, data, valid_nationalities):
+        """Local confidence of a result; backends that derive fields from the MRZ override this."""
+        return score_extraction(data, valid_nationalities)
+
+
+class OpenAIExtractor(Extractor):
+    name = "openai"
+    capabilities = {"network": True, "paid": True, "reads_mrz": True}
+
+    def __init__(self, api_key, model="gpt-4o"):
+        self.api_key = api_key
+        self.model = model
+
+    def is_available(self):
+        return OpenAI is not None and bool(self.api_key)
+
+    def extract(self, image_bytes, log=None):
+        client = OpenAI(api_key=self.api_key)
+        base64_image = base64.b64encode(image_bytes).decode('utf-8')
+        try:
+            response = client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": "You are a passport extraction API. Output only JSON."},
+                    {"role": "user", "content": [
+                        {"type": "text", "text": EXTRACTION_PROMPT},
+                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+                    ]}
+                ],
+                response_format={"type": "json_object"}
+            )
+            data = clean_and_parse_json(response.choices[0].message.content)
+        except Exception as e:
+            raise ExtractionError(f"OpenAI Error: {e}") from e
+        data["model"] = self.model
+        return data
+
+
+class GeminiExtractor(Extractor):
+    """
+    Runs Gemini as a tiered cascade: the fast tier first, escalating to the
+    next tier only when the locally scored confidence is too low.
+    """
+
+    name = "gemini"
+    capabilities = {"network": True, "paid": True, "reads_mrz": True}
+
+    def __init__(self, api_key, model_tiers, min_confidence, valid_nationalities):
+        self.api_key = api_key
+        self.model_tiers = model_tiers
+        self.min_confidence = min_confidence
+        self.valid_nationalities = valid_nationalities
+
+    def is_available(self):
+        return genai is not None and bool(self.api_key)
+
+    def extract(self, image_bytes, log=None):
+        log = log or print
+        genai.configure(api_key=self.api_key)
+
+        best = None
+        best_failed = []
+        last_err = None
+        for tier_name, model_names in self.model_tiers:
+            for name in model_names:
+                try:
+                    model = genai.GenerativeModel(name)
+                    image = Image.open(io.BytesIO(image_bytes))
+                    response = model.generate_content([EXTRACTION_PROMPT, image])
+
+                    try:
+                        data = clean_and_parse_json(response.text)
+                    except json.JSONDecodeError:
+                        # Retry or skip if JSON is malformed
+                        continue
+
+                    if "passport_number" not in data:
+                        continue
+
+                    confidence, failed_checks = score_extraction(data, self.valid_nationalities)
+                    data["model"] = name
+                    data["confidence"] = confidence
+                    if best is None or confidence > best["confidence"]:
+                        best, best_failed = data, failed_checks
+                    break # One working model per tier is enough
+                except Exception as e:
+                    last_err = e
+                    continue
+
+            if best is not None and best["confidence"] >= self.min_confidence:
+                return best
+            if best is not None:
+                log(f"🔁 Low confidence ({best['confidence']:.0%}, failed: {', '.join(best_failed)}) after {tier_name} tier, escalating...")
+
+        if best is not None:
+            return best
+        raise ModelCompatibilityError(f"All attempted models failed. Last error: {last_err}")
+
+
+# --- LOCAL MRZ OCR ---
+MRZ_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789<"
+
+# Common OCR confusions, applied only where the TD3 layout fixes the character class
+_TO_DIGIT = str.maketrans({"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "Z": "2", "S": "5", "G": "6", "B": "8"})
+_TO_ALPHA = str.maketrans({"0": "O", "1": "I", "2": "Z", "5": "S", "6": "G", "8": "B"})
+
+
+def _fix_td3_line2(line):
+    """Repairs digit/letter confusions in the fixed-position fields of MRZ line 2."""
+    chars = list(line)
+
+    def fix(start, end, table):
+        chars[start:end] = list("".join(chars[start:end]).translate(table))
+
+    fix(9, 10, _TO_DIGIT)   # passport number check digit
+    fix(10, 13, _TO_ALPHA)  # nationality
+    fix(13, 20, _TO_DIGIT)  # date of birth + check digit
+    fix(21, 28, _TO_DIGIT)  # expiry + check digit
+    fix(42, 44, _TO_DIGIT)  # personal number check + composite check
+    if chars[20] not in "FM<":
+        chars[20] = "<"
+    return "".join(chars)
+
+
+def find_mrz_band(image):
+    """
+    Locates the MRZ band: the lowest block of dense text rows in the bottom half.
+    Returns a crop of the original image (falls back to the bottom 30%).
+    """
+    width, height = image.size
+    scale = 600 / max(width, 1)
+    small = ImageOps.grayscale(image).resize((600, max(1, int(height * scale))))
+    # Dark text on light background -> 1 for ink
+    binary = small.point(lambda p: 1 if p < 110 else 0)
+    small_w, small_h = binary.size
+    pixels = binary.load()
+
+    ink_rows = []
+    for y in range(small_h):
+        ink = sum(pixels[x, y] for x in range(0, small_w, 2))
+        ink_rows.append(ink / (small_w / 2) > 0.08)
+
+    # Walk up from the bottom, collecting the last block of text rows (allowing small gaps)
+    bottom = None
+    top = None
+    gap = 0
+    for y in range(small_h - 1, small_h // 2, -1):
+        if ink_rows[y]:
+            if bottom is None:
+                bottom = y
+            top = y
+            gap = 0
+        elif bottom is not None:
+            gap += 1
+            if gap > max(4, small_h // 40):
+                break
+
+    if bottom is None or (bottom - top) < small_h * 0.04:
+        return image.crop((0, int(height * 0.7), width, height))
+
+    pad = int((bottom - top) * 0.25)
+    top = max(0, int((top - pad) / scale))
+    bottom = min(height, int((bottom + pad) / scale))
+    return image.crop((0, top, width, bottom))
+
+
+def read_mrz_lines(band):
+    """OCRs an MRZ band and returns the two 44-character TD3 lines, or None."""
+    prepared = ImageOps.grayscale(band)
+    if prepared.width < 1200:
+        factor = 1200 / prepared.width
+        prepared = prepared.resize((1200, int(prepared.height * factor)), Image.LANCZOS)
+    prepared = ImageOps.autocontrast(prepared).filter(ImageFilter.SHARPEN)
+
+    text = pytesseract.image_to_string(
+        prepared, config=f"--psm 6 -c tessedit_char_whitelist={MRZ_ALPHABET}"
+    )
+    lines = [re.sub(r'[^A-Z0-9<]', '', line.upper()) for line in text.splitlines()]
+    lines = [line for line in lines if len(line) >= 40]
+    if len(lines) < 2:
+        return None
+
+    line1, line2 = lines[-2], lines[-1]
+    # Tesseract tends to drop trailing fillers; pad/trim to the TD3 width
+    line1 = (line1 + "<" * 44)[:44]
+    line2 = _fix_td3_line2((line2 + "<" * 44)[:44])
+    return line1, line2
+
+
+class LocalMRZExtractor(Extractor):
+    """
+    CPU-only backend: finds the MRZ band with Pillow and reads it with Tesseract.
+    No network access; results are scored by the MRZ check digits.
+    """
+
+    name = "local-mrz"
+    capabilities = {"network": False, "paid": False, "reads_mrz": True}
+    _tesseract_found = None # Checked once per process: it spawns `tesseract --version`
+
+    def is_available(self):
+        if pytesseract is None:
+            return False
+        if LocalMRZExtractor._tesseract_found is None:
+            try:
+                pytesseract.get_tesseract_version()
+                LocalMRZExtractor._tesseract_found = True
+            except Exception:
+                LocalMRZExtractor._tesseract_found = False
+        return LocalMRZExtractor._tesseract_found
+
+    def extract(self, image_bytes, log=None):
+        # Any local failure must surface as ExtractionError so the chain falls through to the cloud
+        try:
+            image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes))).convert("RGB")
+        except Exception as e:
+            raise ExtractionError(f"Unreadable image: {e}") from e
+
+        # Try the detected band first, then the plain bottom crop
+        candidates = [find_mrz_band(image), image.crop((0, int(image.height * 0.65), image.width, image.height))]
+        for band in candidates:
+            try:
+                lines = read_mrz_lines(band)
+            except Exception as e:
+                raise ExtractionError(f"Tesseract failed: {e}") from e
+            if not lines:
+                continue
+            mrz = parse_td3_mrz(*lines)
+            if not mrz:
+                continue
+            return {
+                "full_name": mrz["full_name"],
+                "passport_number": mrz["passport_number"],
+                "nationality_code": mrz["nationality_code"],
+                "dob": mrz["dob"],
+                "sex": mrz["sex"],
+                "mrz": list(lines),
+                "model": self.name,
+            }
+        raise ExtractionError("No readable MRZ found")
+
+    def score(self, data, valid_nationalities):
+        # Every field comes from the MRZ, so printed-vs-MRZ matches prove nothing here
+        return score_mrz_read(data, valid_nationalities)
+
+
+class ExtractorChain:
+    """
+    Tries backends in order (cheap/local first) and returns the first result
+    whose local confidence reaches `min_confidence`, otherwise the best one.
+    `network_slot()` returns a context manager held only around backends that
+    use the network (e.g. a shared LLM concurrency slot).
+    """
+
+    def __init__(self, backends, min_confidence, valid_nationalities, network_slot=None):
+        self.backends = [b for b in backends if b.is_available()]
+        self.min_confidence = min_confidence
+        self.valid_nationalities = valid_nationalities
+        self.network_slot = network_slot
+
+    def extract(self, image_bytes, log=None):
+        log = log or print
+        if not self.backends:
+            raise ExtractionError("No extraction backend is available")
+
+        best = None
+        errors = []
+        for backend in self.backends:
+            slot = self.network_slot() if self.network_slot and backend.capabilities.get("network") else nullcontext()
+            try:
+                with slot:
+                    started = time.perf_counter()
+                    data = backend.extract(image_bytes, log=log)
+            except ExtractionError as e:
+                errors.append(e)
+                log(f"↪️ {backend.name}: {e}")
+                continue
+
+            confidence, failed_checks = backend.score(data, self.valid_nationalities)
+            data["confidence"] = confidence
+            data["backend"] = backend.name
+            data["elapsed_s"] = round(time.perf_counter() - started, 2)
+            if best is None or confidence > best["confidence"]:
+                best = data
+            if confidence >= self.min_confidence:
+                return data
+            log(f"🔁 {backend.name} confidence {confidence:.0%} (failed: {', '.join(failed_checks)}), trying next backend...")
+
+        if best is not None:
+            return best
+        # Surface the most specific error (e.g. model compatibility) to the caller
+        raise next((e for e in errors if isinstance(e, ModelCompatibilityError)), errors[-1])
@@ -0,0 +1,177 @@
+import os
+import csv
+import io
+import sqlite3
+import datetime
+
+LEDGER_PATH = os.path.join("output", "ledger.sqlite3")
+
+# Every extraction, submission and batch screenshot becomes one row; rows are never changed
+LEDGER_COLUMNS = [
+    "recorded_at", "batch_id", "event", "outcome", "detail",
+    "listing", "arrival_date", "departure_date",
+    "passport_number", "full_name", "nationality_code", "dob", "sex",
+    "backend", "model", "confidence", "extraction_s", "submission_s",
+    "source_file", "screenshot_path", "drive_file_id",
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ledger (
+    id INTEGER PRIMARY KEY,
+    recorded_at TEXT NOT NULL,
+    batch_id TEXT,
+    event TEXT NOT NULL,
+    outcome TEXT,
+    detail TEXT,
+    listing TEXT,
+    arrival_date TEXT,
+    departure_date TEXT,
+    passport_number TEXT,
+    full_name TEXT,
+    nationality_code TEXT,
+    dob TEXT,
+    sex TEXT,
+    backend TEXT,
+    model TEXT,
+    confidence REAL,
+    extraction_s REAL,
+    submission_s REAL,
+    source_file TEXT,
+    screenshot_path TEXT,
+    drive_file_id TEXT
+);
+CREATE INDEX IF NOT EXISTS ledger_passport ON ledger (passport_number);
+CREATE INDEX IF NOT EXISTS ledger_listing_arrival ON ledger (listing, arrival_date);
+CREATE INDEX IF NOT EXISTS ledger_arrival ON ledger (arrival_date);
+CREATE INDEX IF NOT EXISTS ledger_batch ON ledger (batch_id, event);
+CREATE TRIGGER IF NOT EXISTS ledger_no_update BEFORE UPDATE ON ledger
+BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS ledger_no_delete BEFORE DELETE ON ledger
+BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END;
+"""
+
+
+def to_iso_date(value):
+    """Accepts DD/MM/YYYY strings or date objects and returns YYYY-MM-DD (sortable, indexable)."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    try:
+        return datetime.datetime.strptime(str(value), "%d/%m/%Y").date().isoformat()
+    except ValueError:
+        return str(value)
+
+
+def _connect(path=LEDGER_PATH):
+    """One short-lived connection per call, so worker threads never share a connection."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    # WAL lets the UI read while batches append
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def record(event, path=LEDGER_PATH, **fields):
+    """Appends one ledger row. Unknown keys are ignored; dates are normalised to ISO."""
+    row = {column: fields.get(column) for column in LEDGER_COLUMNS}
+    row["event"] = event
+    row["recorded_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+    for column in ("arrival_date", "departure_date"):
+        row[column] = to_iso_date(row[column])
+    if row["passport_number"]:
+        row["passport_number"] = str(row["passport_number"]).replace(" ", "").upper()
+
+    placeholders = ", ".join("?" for _ in LEDGER_COLUMNS)
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.execute(
+                f"INSERT INTO ledger ({', '.join(LEDGER_COLUMNS)}) VALUES ({placeholders})",
+                [row[column] for column in LEDGER_COLUMNS],
+            )
+    finally:
+        conn.close()
+
+
+def _where(passport_number=None, listing=None, date_from=None, date_to=None, event=None):
+    """Builds a WHERE clause that only uses indexed columns."""
+    clauses, params = [], []
+    if passport_number:
+        clauses.append("r.passport_number = ?")
+        params.append(passport_number.replace(" ", "").upper())
+    if listing:
+        clauses.append("r.listing = ?")
+        params.append(listing)
+    if date_from:
+        clauses.append("r.arrival_date >= ?")
+        params.append(to_iso_date(date_from))
+    if date_to:
+        clauses.append("r.arrival_date <= ?")
+        params.append(to_iso_date(date_to))
+    if event:
+        clauses.append("r.event = ?")
+        params.append(event)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+# Guest rows joined with their batch's screenshot row (one per batch)
+_SELECT = """
+SELECT r.id, r.recorded_at, r.event, r.outcome, r.listing, r.arrival_date, r.departure_date,
+       r.passport_number, r.full_name, r.nationality_code, r.dob, r.sex,
+       r.backend, r.model, r.confidence, r.extraction_s, r.submission_s, r.detail, r.batch_id,
+       COALESCE(r.screenshot_path, s.screenshot_path) AS screenshot_path,
+       COALESCE(r.drive_file_id, s.drive_file_id) AS drive_file_id
+FROM ledger r
+LEFT JOIN ledger s ON s.id = (
+    SELECT MAX(id) FROM ledger WHERE batch_id = r.batch_id AND event = 'screenshot'
+)
+"""
+
+
+def query(limit=500, path=LEDGER_PATH, **filters):
+    """
+    Returns (total matching rows, newest `limit` rows as dicts).
+    All filters hit an index, so this stays fast at hundreds of thousands of rows.
+    """
+    where, params = _where(**filters)
+    conn = _connect(path)
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM ledger r{where}", params).fetchone()[0]
+        rows = conn.execute(f"{_SELECT}{where} ORDER BY r.id DESC LIMIT ?", params + [limit]).fetchall()
+        return total, [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+
+def export_csv(path=LEDGER_PATH, **filters):
+    """Streams every matching row into CSV bytes for download."""
+    where, params = _where(**filters)
+    conn = _connect(path)
+    buffer = io.StringIO()
+    try:
+        cursor = conn.execute(f"{_SELECT}{where} ORDER BY r.id", params)
+        writer = csv.writer(buffer)
+        writer.writerow([d[0] for d in cursor.description])
+        while True:
+            batch = cursor.fetchmany(5000)
+            if not batch:
+                break
+            writer.writerows(batch)
+    finally:
+        conn.close()
+    return buffer.getvalue().encode("utf-8")
+
+
+def listings(path=LEDGER_PATH):
+    """Distinct listings in the ledger (served from the listing index)."""
+    conn = _connect(path)
+    try:
+        return [row[0] for row in conn.execute(
+            "SELECT DISTINCT listing FROM ledger WHERE listing IS NOT NULL ORDER BY listing"
+        )]
+    finally:
+        conn.close()
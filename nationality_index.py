@@ -0,0 +1,154 @@
+import os
+import json
+import hashlib
+import tempfile
+import unicodedata
+
+NATIONALITY_CACHE = os.path.join("output", "nationality_index.json")
+
+# ISO / MRZ codes that the portal lists under a legacy code
+NATIONALITY_ALIASES = {
+    "DEU": "D",
+    "D<<": "D",
+    "ROU": "ROM",
+    "COD": "ZAR",
+    "XKX": "RKS",
+    "UNK": "RKS",
+}
+
+# One round trip: read every option's value and text from the dropdown
+_SNAPSHOT_JS = """
+var select = document.getElementById(arguments[0]);
+if (!select) { return null; }
+var options = [];
+for (var i = 0; i < select.options.length; i++) {
+    options.push([select.options[i].value, select.options[i].text]);
+}
+return options;
+"""
+
+# One round trip: set the value and let the portal's listeners see the change
+_SELECT_JS = """
+var select = document.getElementById(arguments[0]);
+select.value = arguments[1];
+select.dispatchEvent(new Event('change', {bubbles: true}));
+return select.value === arguments[1];
+"""
+
+
+def _normalize(key):
+    """Uppercases and strips Vietnamese diacritics so names match regardless of accents."""
+    key = str(key or "").replace("Đ", "D").replace("đ", "d")
+    key = unicodedata.normalize("NFKD", key)
+    key = "".join(c for c in key if not unicodedata.combining(c))
+    return " ".join(key.upper().split())
+
+
+def options_hash(options):
+    return hashlib.sha256(json.dumps(options, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class NationalityIndex:
+    """
+    Constant-time lookup from ISO codes, legacy aliases and country names
+    to the portal's nationality code and its `<option>` value.
+    """
+
+    def __init__(self, options, live=True):
+        self.options = [list(option) for option in options]
+        self.live = live # False when built from NATIONALITY_MAP without a dropdown snapshot
+        self.hash = options_hash(self.options)
+        self._keys = {}
+        self._values = {}
+        self._texts = {}
+
+        entries = []
+        for value, text in self.options:
+            code, _, name = text.partition(" - ")
+            code = code.strip().upper()
+            if not code or not name:
+                continue # Placeholder option such as "-- Chọn --"
+            self._values[code] = value
+            self._texts[code] = text
+            entries.append((code, text, name))
+
+        # Codes first so a country name can never shadow a real code
+        for code, _, _ in entries:
+            self._keys[_normalize(code)] = code
+        for alias, code in NATIONALITY_ALIASES.items():
+            if code in self._values:
+                self._keys.setdefault(_normalize(alias), code)
+        for code, text, name in entries:
+            self._keys.setdefault(_normalize(text), code)
+            self._keys.setdefault(_normalize(name), code)
+
+    @classmethod
+    def from_map(cls, nationality_map):
+        """Offline index from NATIONALITY_MAP; option values are the visible texts."""
+        return cls([[text, text] for text in nationality_map.values()], live=False)
+
+    def resolve(self, code_or_name):
+        """Returns the portal's nationality code, or None if unknown."""
+        return self._keys.get(_normalize(code_or_name))
+
+    def __contains__(self, code_or_name):
+        return self.resolve(code_or_name) is not None
+
+    def option_value(self, code):
+        return self._values.get(code)
+
+    def option_text(self, code):
+        return self._texts.get(code)
+
+    def save(self, path=NATIONALITY_CACHE):
+        """Writes a temp file and swaps it in, so concurrent sessions never read a torn snapshot."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"hash": self.hash, "options": self.options}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def load_nationality_index(nationality_map, path=NATIONALITY_CACHE):
+    """Loads the last dropdown snapshot from disk, falling back to NATIONALITY_MAP."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            cached = json.load(f)
+        index = NationalityIndex(cached["options"])
+        if index.hash == cached.get("hash"):
+            return index
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return NationalityIndex.from_map(nationality_map)
+
+
+def snapshot_nationality_options(driver, element_id):
+    """Reads all `<option>` values and texts of the dropdown in a single call."""
+    return driver.execute_script(_SNAPSHOT_JS, element_id)
+
+
+def refresh_nationality_index(index, options, path=NATIONALITY_CACHE):
+    """
+    Compares a fresh dropdown snapshot with the current index.
+    Rebuilds and re-caches the index only when the dropdown changed.
+    """
+    if not options:
+        return index
+    if index.live and options_hash([list(option) for option in options]) == index.hash:
+        return index
+    index = NationalityIndex(options)
+    index.save(path)
+    return index
+
+
+def select_nationality(driver, element_id, index, code):
+    """Sets the dropdown to the option for `code` by value in one call."""
+    value = index.option_value(code)
+    if value is None:
+        return False
+    return bool(driver.execute_script(_SELECT_JS, element_id, value))
@@ -6,7 +6,6 @@ import json
 import time
 import datetime
 import re
-import base64
 
 # Patch importlib.metadata for Python 3.9 compatibility
 try:
@@ -18,8 +17,6 @@ except ImportError:
 
 import streamlit as st
 import google.generativeai as genai
-from PIL import Image
-from openai import OpenAI
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
@@ -28,6 +25,13 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.service import Service
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
 from google_drive import upload_screenshot_to_drive
+from admission import AdmissionController
+from extractors import ExtractorChain, LocalMRZExtractor, GeminiExtractor, OpenAIExtractor, ExtractionError, ModelCompatibilityError
+from nationality_index import load_nationality_index, snapshot_nationality_options, refresh_nationality_index, select_nationality
+from portal_health import PortalMonitor
+from batch_worker import start_batch, BatchCancelled
+import ledger
+from browser_profile import build_chrome_options, enable_lean_network, collect_page_metrics, save_page_metrics, summarize_page_metrics
 
 # --- CONFIGURATION ---
 
@@ -54,6 +58,62 @@ if not LISTINGS:
         "Example Villa": {"username": "demo", "password": "demo"},
     }
 
+# 4. Portal
+PORTAL_INDEX_URL = "https://danang.xuatnhapcanh.gov.vn/faces/index.jsf"
+PORTAL_LIST_URL = "https://danang.xuatnhapcanh.gov.vn/faces/manage_kbtt.jsf"
+
+# 5. Admission Control (shared by every user of this server)
+ADMISSION = st.secrets.get("admission", {})
+MAX_CONCURRENT_BROWSERS = int(ADMISSION.get("max_browsers", os.getenv("MAX_CONCURRENT_BROWSERS", 2)))
+MAX_CONCURRENT_LLM = int(ADMISSION.get("max_llm_requests", os.getenv("MAX_CONCURRENT_LLM", 4)))
+MIN_FREE_MEMORY_MB = int(ADMISSION.get("min_free_memory_mb", os.getenv("MIN_FREE_MEMORY_MB", 600)))
+
+@st.cache_resource
+def get_admission_controller():
+    """One controller per server process, shared across all Streamlit sessions"""
+    return AdmissionController(MAX_CONCURRENT_BROWSERS, MAX_CONCURRENT_LLM, MIN_FREE_MEMORY_MB)
+
+@st.cache_resource
+def get_portal_monitor():
+    """Portal health, step latencies and circuit breaker shared by every batch on this server"""
+    return PortalMonitor(PORTAL_INDEX_URL)
+
+def record_to_ledger(ui, event, **fields):
+    """Appends to the local registration ledger; a ledger problem must never stop a registration"""
+    try:
+        ledger.record(event, batch_id=ui.batch_id, **fields)
+    except Exception as e:
+        ui.warning(f"⚠️ Could not write to the ledger: {e}")
+
+def guest_ledger_fields(guest_data):
+    """The extraction fields of a guest as ledger columns"""
+    return {
+        "passport_number": guest_data.get('passport_number'),
+        "full_name": guest_data.get('full_name'),
+        "nationality_code": guest_data.get('nationality_code'),
+        "dob": guest_data.get('dob'),
+        "sex": guest_data.get('sex'),
+        "backend": guest_data.get('backend'),
+        "model": guest_data.get('model'),
+        "confidence": guest_data.get('confidence'),
+        "extraction_s": guest_data.get('elapsed_s'),
+        "source_file": guest_data.get('file'),
+    }
+
+def queue_status_callback(ui, what):
+    """Builds an on_wait callback that shows queue position and ETA to this user"""
+    def on_wait(position, eta_s, reason):
+        ui.check_cancelled()
+        ui.set_status(f"⏳ Waiting for {what} — position {position} in queue, ETA ~{eta_s}s ({reason})")
+    return on_wait
+
+# 6. Extraction Cascade: cheapest/fastest tier first, escalate only on low confidence
+GEMINI_MODEL_TIERS = [
+    ("fast", ['gemini-2.5-flash', 'gemini-2.0-flash', 'gemini-1.5-flash']),
+    ("pro", ['gemini-2.5-pro', 'gemini-1.5-pro']),
+]
+CASCADE_MIN_CONFIDENCE = float(os.getenv("CASCADE_MIN_CONFIDENCE", 0.85))
+
 # Map codes to the exact text in the dropdown
 NATIONALITY_MAP = {
     "0RQ": "0RQ - Không rõ quốc tịch",
@@ -314,132 +374,81 @@ NATIONALITY_MAP = {
     "ZWE": "ZWE - Dim-ba-bu-ê",
 }
 
-# --- 1. THE BRAIN (Passport Reader - Hybrid Version) ---
-def extract_passport_data(uploaded_file, api_key):
-    """Detects API key type and extracts data using Gemini or OpenAI"""
-    
-    # Common helper to clean and parse JSON
-    def clean_and_parse_json(text_content):
-        text_content = text_content.strip()
-        # Find first { and last }
-        match = re.search(r'(\{.*\})', text_content, re.DOTALL)
-        if match:
-            text_content = match.group(1)
-        return json.loads(text_content)
-
-    # 1. Choose Engine based on API Key
+# Constant-time nationality lookup (codes, legacy aliases, country names),
+# refreshed from the live dropdown once per automation session
+NATIONALITY_SELECT_ID = "pt1:r1:1:soc4::content"
+NATIONALITY_INDEX = load_nationality_index(NATIONALITY_MAP)
+
+# --- 1. THE BRAIN (Passport Reader - Pluggable Backends) ---
+def build_extractor_chain(api_key, use_local_mrz=False, network_slot=None):
+    """Local MRZ reader first (if enabled), then the cloud engine picked by API key type"""
+    backends = []
+    if use_local_mrz:
+        backends.append(LocalMRZExtractor())
     if api_key.startswith("sk-"):
-        # OpenAI Version
-        st.info("💡 Using OpenAI engine (GPT-4o)")
-        client = OpenAI(api_key=api_key)
-        base64_image = base64.b64encode(uploaded_file.getvalue()).decode('utf-8')
-        
-        prompt = """
-        Extract data from this passport into this JSON structure:
-        {
-          "full_name": "STRING (UPPERCASE)",
-          "passport_number": "STRING",
-          "nationality_code": "3-letter ISO code (e.g. BGR, USA, KOR)",
-          "dob": "DD/MM/YYYY",
-          "sex": "F or M"
-        }
-        """
+        backends.append(OpenAIExtractor(api_key))
+    elif api_key:
+        backends.append(GeminiExtractor(api_key, GEMINI_MODEL_TIERS, CASCADE_MIN_CONFIDENCE, NATIONALITY_INDEX))
+    return ExtractorChain(backends, CASCADE_MIN_CONFIDENCE, NATIONALITY_INDEX, network_slot)
 
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are a passport extraction API. Output only JSON."},
-                    {"role": "user", "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                    ]}
-                ],
-                response_format={"type": "json_object"}
-            )
-            content = response.choices[0].message.content
-            return clean_and_parse_json(content)
-        except Exception as e:
-            st.error(f"OpenAI Error: {e}")
-            raise e
+def extract_passport_data(ui, image_bytes, api_key, use_local_mrz=False, network_slot=None):
+    """Extracts passport data, only paying for a cloud call when the local reader isn't confident"""
+    chain = build_extractor_chain(api_key, use_local_mrz, network_slot)
+    ui.info(f"💡 Extraction backends: {' → '.join(b.name for b in chain.backends) or 'none'}")
     
-    else:
-        # Gemini Version
-        st.info("💡 Using Google Gemini engine")
-        genai.configure(api_key=api_key)
-        
-        # Try a wider variety of model names
-        model_names = [
-            'gemini-2.5-flash',
-            'gemini-2.5-pro',
-            'gemini-2.0-flash',
-            'gemini-1.5-flash', 
-            'gemini-1.5-pro'
-        ]
-        
-        last_err = None
-        for name in model_names:
-            try:
-                model = genai.GenerativeModel(name)
-                image = Image.open(uploaded_file)
-                prompt = """
-                Analyze this passport image and extract data into strict JSON:
-                {
-                  "full_name": "STRING (UPPERCASE)",
-                  "passport_number": "STRING",
-                  "nationality_code": "3-letter ISO code (e.g. BGR, USA, KOR)",
-                  "dob": "DD/MM/YYYY",
-                  "sex": "F or M"
-                }
-                Return ONLY the JSON. No markdown.
-                """
-                response = model.generate_content([prompt, image])
-                
-                try:
-                    data = clean_and_parse_json(response.text)
-                except json.JSONDecodeError:
-                    # Retry or skip if JSON is malformed
-                    continue
-                
-                if "passport_number" in data:
-                    st.success(f"✅ Success using model: {name}")
-                    return data
-            except Exception as e:
-                last_err = e
-                continue
-        
-        # If we reach here, all models failed. Let's list what's available.
-        st.error(f"❌ All attempted models failed. Last error: {last_err}")
+    try:
+        data = chain.extract(image_bytes, log=ui.write)
+    except ModelCompatibilityError as e:
+        # All Gemini models failed. Let's list what's available.
+        ui.error(f"❌ {e}")
         try:
             available_models = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
-            st.write("### 🛠 Diagnostic: Available models for your key:")
-            st.code("\n".join(available_models))
-            st.info("Please copy an available model name from the list above and let me know.")
+            ui.write("### 🛠 Diagnostic: Available models for your key:")
+            ui.code("\n".join(available_models))
+            ui.info("Please copy an available model name from the list above and let me know.")
         except Exception as list_err:
-            st.error(f"Could not list models: {list_err}")
+            ui.error(f"Could not list models: {list_err}")
         
         raise Exception("Model compatibility error. See diagnostic info above.")
+    except ExtractionError as e:
+        ui.error(f"❌ {e}")
+        raise
+    
+    if data["confidence"] >= CASCADE_MIN_CONFIDENCE:
+        ui.success(f"✅ Success using {data['backend']} / {data['model']} (confidence {data['confidence']:.0%}, {data['elapsed_s']}s)")
+    else:
+        # Nothing beat the threshold; return the most consistent result we have
+        ui.warning(f"⚠️ Best result from {data['model']} is below the confidence threshold ({data['confidence']:.0%}). Please double-check it.")
+    return data
 
 # --- 2. THE HANDS (Selenium Automation) ---
-def run_automation(guests_list, username, password, arrival_date_str, departure_date_str, listing_name, headless_mode=True):
-    """Runs the browser automation with a list of extracted guest data"""
+def run_automation(ui, guests_list, username, password, arrival_date_str, departure_date_str, listing_name, headless_mode=True, lean_mode=False, profile_slot=0, portal=None):
+    """Runs the browser automation with a list of extracted guest data, reporting through `ui`.
+    Returns None when every guest was saved, otherwise the reason the run stopped."""
     
-    st.info("🚀 Starting automation engine...")
+    ui.info("🚀 Starting automation engine...")
+    
+    # Every guest ends up with exactly one "submitted" ledger row, whatever stops the run
+    stay = {"listing": listing_name, "arrival_date": arrival_date_str, "departure_date": departure_date_str}
+    submitted = set() # Indices of guests that already have their row
+    current_guest = None # Index of the guest being filled or saved
+    stop_reason = None
+
+    def record_unsubmitted(reason):
+        """Records the guests left without a row: the one in progress as failed, the rest as skipped"""
+        for j, guest in enumerate(guests_list):
+            if j in submitted:
+                continue
+            outcome = "failed" if j == current_guest else "skipped"
+            ui.update_guest(guest.get('guest_key', f"{j+1}. {guest['full_name']}"), outcome, reason)
+            record_to_ledger(ui, "submitted", outcome=outcome, detail=reason[:500], **stay, **guest_ledger_fields(guest))
     
     # Setup Browser
-    options = webdriver.ChromeOptions()
-    options.add_experimental_option("detach", True) # Keep browser open
     if headless_mode:
-        st.info("👻 Running in Headless Mode (Invisible Browser)")
-        options.add_argument("--headless")
-        options.add_argument("--window-size=1920,1080")
-    
-    # Stability Flags for macOS/Linux
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--disable-extensions")
-    options.add_argument("--disable-infobars")
+        ui.info("👻 Running in Headless Mode (Invisible Browser)")
+    if lean_mode:
+        ui.info("⚡ Running in Lean Mode (blocking images, fonts and trackers)")
+    options = build_chrome_options(headless_mode, lean_mode, listing_name, profile_slot)
     
     # Platform-specific binary location (Only for Mac)
     if sys.platform == "darwin":
@@ -452,24 +461,56 @@ def run_automation(guests_list, username, password, arrival_date_str, departure_
         service = Service() 
         driver = webdriver.Chrome(service=service, options=options)
     except Exception as init_err:
-        st.error(f"❌ Failed to initialize Chrome: {init_err}")
-        st.info("💡 Tip: Ensure Google Chrome is installed and updated.")
-        return
+        ui.error(f"❌ Failed to initialize Chrome: {init_err}")
+        ui.info("💡 Tip: Ensure Google Chrome is installed and updated.")
+        stop_reason = "Chrome failed to start"
+        record_unsubmitted(f"{stop_reason}: {init_err}")
+        return stop_reason
+
+    if lean_mode:
+        enable_lean_network(driver)
+    page_metrics = []
+    nat_index = NATIONALITY_INDEX
+    nat_snapshot_taken = False
 
-    wait = WebDriverWait(driver, 30)
+    portal = portal or get_portal_monitor()
+
+    def wait_for(step, condition, count_failure=True):
+        """WebDriverWait with a timeout adapted to this step's recently observed latency"""
+        started = time.perf_counter()
+        try:
+            result = WebDriverWait(driver, portal.timeout_for(step, lean_mode)).until(condition)
+        except TimeoutException:
+            if count_failure:
+                portal.record_timeout(step)
+            raise
+        portal.record_step(step, time.perf_counter() - started, lean_mode)
+        return result
+
+    def open_page(step, url):
+        """driver.get() bounded by the adaptive timeout instead of Chrome's 300 s default"""
+        driver.set_page_load_timeout(portal.timeout_for(step, lean_mode))
+        started = time.perf_counter()
+        try:
+            driver.get(url)
+        except TimeoutException:
+            portal.record_timeout(step)
+            raise
+        portal.record_step(step, time.perf_counter() - started, lean_mode)
 
     try:
         # Login
-        st.info("🌐 Navigating to portal and logging in...")
-        driver.get("https://danang.xuatnhapcanh.gov.vn/faces/index.jsf")
+        ui.info("🌐 Navigating to portal and logging in...")
+        open_page("open_portal", PORTAL_INDEX_URL)
         
         # 1. Click "Đăng nhập" to reveal form
-        login_reveal = wait.until(EC.element_to_be_clickable((By.ID, "pt1:pt_l1")))
+        login_reveal = wait_for("login_reveal", EC.element_to_be_clickable((By.ID, "pt1:pt_l1")))
+        page_metrics.append(collect_page_metrics(driver, "login", lean_mode))
         login_reveal.click()
         
         # 2. WAIT for Username field to be VISIBLE
-        st.write("⏳ Waiting for login form to appear...")
-        user_field = wait.until(EC.visibility_of_element_located((By.ID, "pt1:s1:it1::content")))
+        ui.write("⏳ Waiting for login form to appear...")
+        user_field = wait_for("login_form", EC.visibility_of_element_located((By.ID, "pt1:s1:it1::content")))
         user_field.clear()
         user_field.send_keys(username)
         
@@ -478,47 +519,62 @@ def run_automation(guests_list, username, password, arrival_date_str, departure_
         pass_field.send_keys(password)
         
         # 3. Click Login Button
-        st.write("🖱 Attempting login click...")
-        login_btn_wrapper = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "div[id='pt1:s1:b1'] a")))
+        ui.write("🖱 Attempting login click...")
+        login_btn_wrapper = wait_for("login_button", EC.presence_of_element_located((By.CSS_SELECTOR, "div[id='pt1:s1:b1'] a")))
         driver.execute_script("arguments[0].click();", login_btn_wrapper)
         
         # 4. Verify Login Success
-        st.write("🔍 Verifying login result...")
+        ui.write("🔍 Verifying login result...")
         try:
-            wait.until(EC.presence_of_element_located((By.XPATH, "//*[contains(text(), 'CHỨC NĂNG')] | //*[contains(text(), 'Đăng xuất')]")))
+            wait_for("login_result", EC.presence_of_element_located((By.XPATH, "//*[contains(text(), 'CHỨC NĂNG')] | //*[contains(text(), 'Đăng xuất')]")), count_failure=False)
         except TimeoutException:
             try:
                 error_msg = driver.find_element(By.ID, "pt1:s1:pfl5").text
-                st.error(f"❌ Login Error: {error_msg}")
+                ui.error(f"❌ Login Error: {error_msg}")
             except NoSuchElementException:
-                st.error("⏰ Login failed or timed out. Please check your credentials manually.")
-            return
+                ui.error("⏰ Login failed or timed out. Please check your credentials manually.")
+            stop_reason = "Login failed"
+            return stop_reason
         
-        st.success("✅ Login successful!")
+        ui.success("✅ Login successful!")
         time.sleep(1)
 
         # 1. Navigate to Guest Declaration form ONCE
-        st.write("🔄 Navigating to declaration form...")
-        driver.get("https://danang.xuatnhapcanh.gov.vn/faces/manage_kbtt.jsf")
+        ui.write("🔄 Navigating to declaration form...")
+        open_page("open_guest_list", PORTAL_LIST_URL)
         
         # 2. Click Add New ONCE to enter the form
-        st.write("🖱 Opening 'Thêm mới' form...")
+        ui.write("🖱 Opening 'Thêm mới' form...")
         try:
             add_btn_xpath = "//*[contains(text(), 'Thêm mới')] | //a[contains(., 'Thêm mới')]"
-            add_btn = wait.until(EC.presence_of_element_located((By.XPATH, add_btn_xpath)))
+            add_btn = wait_for("add_button", EC.presence_of_element_located((By.XPATH, add_btn_xpath)))
+            page_metrics.append(collect_page_metrics(driver, "guest_list", lean_mode))
             driver.execute_script("arguments[0].scrollIntoView(true);", add_btn)
             driver.execute_script("arguments[0].click();", add_btn)
         except Exception as e:
-            st.error(f"❌ Failed to click 'Thêm mới': {e}")
-            return
+            ui.error(f"❌ Failed to click 'Thêm mới': {e}")
+            stop_reason = "Could not open the guest form"
+            return stop_reason
 
         # Batch Loop
         for i, guest_data in enumerate(guests_list):
-            st.divider()
-            st.write(f"### 👤 Processing Guest {i+1}/{len(guests_list)}: {guest_data['full_name']}")
+            ui.check_cancelled()
+            guest_key = guest_data.get('guest_key', f"{i+1}. {guest_data['full_name']}")
+            guest_started = time.perf_counter()
+            if not portal.breaker.allow():
+                remaining = ", ".join(g['full_name'] for g in guests_list[i:])
+                ui.error(f"⛔ Portal is degraded (circuit open). Stopped before: {remaining}. Please retry later.")
+                # No final screenshot either: it would drive the browser into the degraded portal
+                stop_reason = "Portal degraded (circuit open)"
+                return stop_reason
+
+            current_guest = i
+            ui.divider()
+            ui.write(f"### 👤 Processing Guest {i+1}/{len(guests_list)}: {guest_data['full_name']}")
+            ui.update_guest(guest_key, "filling", guest_data['full_name'])
             
             # Wait for form to be ready (look for any field)
-            wait.until(EC.presence_of_element_located((By.ID, "pt1:r1:1:it1::content")))
+            wait_for("guest_form", EC.presence_of_element_located((By.ID, "pt1:r1:1:it1::content")))
 
             # --- FILL/OVERWRITE FORM ---
             # 1. Passport Number
@@ -527,29 +583,32 @@ def run_automation(guests_list, username, password, arrival_date_str, departure_
             field_pass.send_keys(guest_data['passport_number'])
 
             # 2. Nationality
-            nat_element = driver.find_element(By.ID, "pt1:r1:1:soc4::content")
-            nat_select = Select(nat_element)
+            # Snapshot the dropdown once per session; the index is rebuilt only if it changed
+            if not nat_snapshot_taken:
+                try:
+                    options = snapshot_nationality_options(driver, NATIONALITY_SELECT_ID)
+                    nat_index = refresh_nationality_index(nat_index, options)
+                except Exception as snap_err:
+                    ui.warning(f"⚠️ Could not snapshot nationality list, using built-in map: {snap_err}")
+                nat_snapshot_taken = True
+
             target_code = guest_data['nationality_code']
+            portal_code = nat_index.resolve(target_code)
             found = False
 
-            # Optimized Selection via Map
-            if target_code in NATIONALITY_MAP:
+            if portal_code:
                 try:
-                    nat_select.select_by_visible_text(NATIONALITY_MAP[target_code])
-                    found = True
+                    if nat_index.live:
+                        found = select_nationality(driver, NATIONALITY_SELECT_ID, nat_index, portal_code)
+                    else:
+                        nat_select = Select(driver.find_element(By.ID, NATIONALITY_SELECT_ID))
+                        nat_select.select_by_visible_text(nat_index.option_text(portal_code))
+                        found = True
                 except Exception:
                     pass
             
-            # Fallback Loop
-            if not found:
-                for option in nat_select.options:
-                    if target_code in option.text:
-                        nat_select.select_by_visible_text(option.text)
-                        found = True
-                        break
-            
             if not found:
-                st.error(f"Could not find nationality code: {target_code}")
+                ui.error(f"Could not find nationality code: {target_code}")
 
             # 3. Full Name
             field_name = driver.find_element(By.ID, "pt1:r1:1:it2::content")
@@ -583,7 +642,7 @@ def run_automation(guests_list, username, password, arrival_date_str, departure_
                 arrival_field.send_keys(arrival_date_str)
                 arrival_field.send_keys(Keys.ESCAPE)
             except Exception as e:
-                st.warning(f"⚠️ Could not auto-fill Arrival Date: {e}")
+                ui.warning(f"⚠️ Could not auto-fill Arrival Date: {e}")
 
             # 7. Departure Date
             try:
@@ -594,7 +653,7 @@ def run_automation(guests_list, username, password, arrival_date_str, departure_
                 departure_field.send_keys(departure_date_str)
                 departure_field.send_keys(Keys.ESCAPE)
             except Exception as e:
-                st.warning(f"⚠️ Could not auto-fill Departure Date: {e}")
+                ui.warning(f"⚠️ Could not auto-fill Departure Date: {e}")
 
             # 8. Room Number (For ALC listings)
             if listing_name.strip().startswith("ALC"):
@@ -610,82 +669,102 @@ def run_automation(guests_list, username, password, arrival_date_str, departure_
                         room_field.clear()
                         room_field.send_keys(room_number)
                 except Exception as e:
-                    st.warning(f"⚠️ Could not auto-fill Room Number for {listing_name}: {e}")
+                    ui.warning(f"⚠️ Could not auto-fill Room Number for {listing_name}: {e}")
 
-            st.info(f"💾 Auto-Saving Guest {i+1}...")
+            ui.info(f"💾 Auto-Saving Guest {i+1}...")
+            ui.update_guest(guest_key, "saving", guest_data['full_name'])
 
             try:
                 # 1. Click "Lưu thông tin"
                 # Locate button by text
                 save_xpath = "//*[contains(text(), 'Lưu thông tin')] | //button[contains(., 'Lưu')]"
-                save_btn = wait.until(EC.element_to_be_clickable((By.XPATH, save_xpath)))
+                save_btn = wait_for("save_button", EC.element_to_be_clickable((By.XPATH, save_xpath)))
                 driver.execute_script("arguments[0].click();", save_btn)
                 
                 # 2. Handle "OK" Success Dialog
-                st.write("⏳ Waiting for confirmation...")
+                ui.write("⏳ Waiting for confirmation...")
                 ok_xpath = "//*[normalize-space(text())='OK'] | //button[contains(., 'OK')]"
-                ok_btn = wait.until(EC.element_to_be_clickable((By.XPATH, ok_xpath)))
+                ok_btn = wait_for("save_confirmation", EC.element_to_be_clickable((By.XPATH, ok_xpath)))
                 driver.execute_script("arguments[0].click();", ok_btn)
-                st.success(f"✅ Guest {i+1} Saved!")
-                
-                time.sleep(2) # Allow transition back to list
-                
-                # 3. Prepare for Next Guest (if any)
-                if i < len(guests_list) - 1:
-                    st.write("🔄 Preparing next guest...")
-                    # Wait for "Thêm mới" to confirm we are back on the list page
-                    add_btn_xpath = "//*[contains(text(), 'Thêm mới')] | //a[contains(., 'Thêm mới')]"
-                    add_btn = wait.until(EC.presence_of_element_located((By.XPATH, add_btn_xpath)))
-                    driver.execute_script("arguments[0].scrollIntoView(true);", add_btn)
-                    driver.execute_script("arguments[0].click();", add_btn)
-
             except Exception as e:
-                st.error(f"❌ Automated Save Failed: {type(e).__name__} - {e}")
+                ui.error(f"❌ Automated Save Failed: {type(e).__name__} - {e}")
+                ui.update_guest(guest_key, "failed", f"Save failed: {type(e).__name__}")
+                submission_s = round(time.perf_counter() - guest_started, 2)
                 
-                # Capture Screenshot for Debugging
+                # Capture Screenshot for Debugging (before the ledger row, so the row can point to it)
+                screenshot_path = None
                 try:
-                    screenshot_path = "error_screenshot.png"
+                    os.makedirs("output", exist_ok=True)
+                    screenshot_path = f"output/error_screenshot_{int(time.time())}.png"
                     driver.save_screenshot(screenshot_path)
-                    st.toast("📸 Screenshot captured for debugging")
-                    st.image(screenshot_path, caption="Error State Screenshot")
+                    ui.toast("📸 Screenshot captured for debugging")
+                    ui.image(screenshot_path, caption="Error State Screenshot")
                 except Exception as shot_err:
-                    st.warning(f"Could not capture screenshot: {shot_err}")
+                    screenshot_path = None
+                    ui.warning(f"Could not capture screenshot: {shot_err}")
+                record_to_ledger(ui, "submitted", outcome="failed", detail=f"{type(e).__name__}: {e}"[:500], submission_s=submission_s, screenshot_path=screenshot_path, **stay, **guest_ledger_fields(guest_data))
+                submitted.add(i)
 
                 # Try to read page source for error messages
                 try:
                     # Generic lookup for JSF/PrimeFaces error messages
                     errors = driver.find_elements(By.CSS_SELECTOR, ".ui-messages-error-summary, .ui-message-error-detail, .ui-messages-error")
                     if errors:
-                        st.error("⚠️ Website Error Messages Found:")
+                        ui.error("⚠️ Website Error Messages Found:")
                         for err in errors:
-                            st.error(f"- {err.text}")
+                            ui.error(f"- {err.text}")
                 except:
                     pass
                 
+                stop_reason = f"Stopped after guest {i+1}'s save failed"
                 break
 
-        st.balloons()
-        st.success("🏁 All guests in the batch have been processed!")
+            ui.success(f"✅ Guest {i+1} Saved!")
+            ui.update_guest(guest_key, "saved", guest_data['full_name'])
+            record_to_ledger(ui, "submitted", outcome="saved", submission_s=round(time.perf_counter() - guest_started, 2), **stay, **guest_ledger_fields(guest_data))
+            submitted.add(i)
+            
+            time.sleep(2) # Allow transition back to list
+            
+            # 3. Prepare for Next Guest (if any). Outside the save block: this guest is saved either way.
+            if i < len(guests_list) - 1:
+                ui.write("🔄 Preparing next guest...")
+                try:
+                    # Wait for "Thêm mới" to confirm we are back on the list page
+                    add_btn_xpath = "//*[contains(text(), 'Thêm mới')] | //a[contains(., 'Thêm mới')]"
+                    add_btn = wait_for("add_button", EC.presence_of_element_located((By.XPATH, add_btn_xpath)))
+                    driver.execute_script("arguments[0].scrollIntoView(true);", add_btn)
+                    driver.execute_script("arguments[0].click();", add_btn)
+                except Exception as e:
+                    ui.error(f"❌ Could not open the form for the next guest: {type(e).__name__} - {e}")
+                    stop_reason = f"Form did not reopen after guest {i+1}"
+                    break
+
+        if stop_reason:
+            ui.warning(f"⚠️ Batch stopped early: {stop_reason}")
+        else:
+            ui.balloons()
+            ui.success("🏁 All guests in the batch have been processed!")
         
         # --- SCREENSHOT & GOOGLE DRIVE UPLOAD ---
-        st.info("📸 Taking a final screenshot of the guest list...")
+        ui.info("📸 Taking a final screenshot of the guest list...")
         # If after the last guest, we are still on the "Thêm mới" form view
         # because the loop skips the final "Thêm mới" click.
         # We need to click "Quay lại" to return to the main guest list.
-        st.write("⏳ Formatting table for screenshot...")
+        ui.write("⏳ Formatting table for screenshot...")
         try:
             # Try to find and click the "Quay lại" (Back) button
             back_xpath = "//*[contains(text(), 'Quay lại')] | //button[contains(., 'Quay lại')] | //a[contains(., 'Quay lại')]"
-            back_btn = wait.until(EC.element_to_be_clickable((By.XPATH, back_xpath)))
+            back_btn = wait_for("back_button", EC.element_to_be_clickable((By.XPATH, back_xpath)), count_failure=False)
             driver.execute_script("arguments[0].click();", back_btn)
             time.sleep(2)
         except Exception:
             # Fallback: if we can't find 'Quay lại', refresh the list via URL but wait carefully
-            driver.get("https://danang.xuatnhapcanh.gov.vn/faces/manage_kbtt.jsf")
+            open_page("open_guest_list", PORTAL_LIST_URL)
         
         try:
             # Wait for list page (presence of search button or add button)
-            wait.until(EC.visibility_of_element_located((By.XPATH, "//*[contains(text(), 'Thêm mới')] | //a[contains(., 'Thêm mới')]")))
+            wait_for("guest_list", EC.visibility_of_element_located((By.XPATH, "//*[contains(text(), 'Thêm mới')] | //a[contains(., 'Thêm mới')]")))
             time.sleep(3)
             
             os.makedirs("output", exist_ok=True)
@@ -701,27 +780,154 @@ def run_automation(guests_list, username, password, arrival_date_str, departure_
                 
             driver.save_screenshot(screenshot_name)
             
-            st.success(f"🖼 Screenshot saved locally as `{screenshot_name}`")
-            st.image(screenshot_name, caption="Final Guest List")
+            ui.success(f"🖼 Screenshot saved locally as `{screenshot_name}`")
+            ui.image(screenshot_name, caption="Final Guest List")
             
             # Upload to Google Drive
-            st.info("☁️ Uploading screenshot to Google Drive...")
+            ui.info("☁️ Uploading screenshot to Google Drive...")
             file_id = upload_screenshot_to_drive(screenshot_name)
+            record_to_ledger(ui, "screenshot", outcome="uploaded" if file_id else "local_only", listing=listing_name, arrival_date=arrival_date_str, departure_date=departure_date_str, screenshot_path=screenshot_name, drive_file_id=file_id)
             
             if file_id:
                 drive_link = f"https://drive.google.com/file/d/{file_id}/view?usp=sharing"
-                st.success(f"✅ Uploaded to Google Drive successfully!")
-                st.markdown(f"**[🔗 Click here to view the screenshot on Google Drive]({drive_link})**")
+                ui.success(f"✅ Uploaded to Google Drive successfully!")
+                ui.markdown(f"**[🔗 Click here to view the screenshot on Google Drive]({drive_link})**")
             else:
-                st.error("❌ Failed to upload screenshot to Google Drive. Check logs/credentials.")
+                ui.error("❌ Failed to upload screenshot to Google Drive. Check logs/credentials.")
                 
         except Exception as ss_err:
-            st.error(f"Failed to capture or upload the final screenshot: {ss_err}")
+            ui.error(f"Failed to capture or upload the final screenshot: {ss_err}")
+
+    except BatchCancelled:
+        stop_reason = "Batch cancelled"
+        raise
 
     except Exception as e:
-        st.error(f"Automation Error: {e}")
+        ui.error(f"Automation Error: {e}")
+        stop_reason = f"Automation Error: {type(e).__name__}"
+
+    finally:
+        if len(submitted) < len(guests_list):
+            record_unsubmitted(stop_reason or "Not submitted")
+
+        # Page-load and memory numbers for comparing lean mode on/off
+        if page_metrics:
+            save_page_metrics(page_metrics)
+            with ui.expander("⏱ Browser Performance"):
+                ui.dataframe(page_metrics)
+
+        # A headless browser is never looked at again; close it so its memory
+        # is actually returned before the next queued user gets a slot.
+        # Lean mode always quits: its persistent profile stays locked while Chrome runs.
+        if headless_mode or lean_mode:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+    return stop_reason
 
-# --- 3. THE APP INTERFACE ---
+# --- 3. THE BATCH (runs on a background thread) ---
+def process_batch(ui, files, api_key, use_local_mrz, credentials, arrival_date_str, departure_date_str, listing_name, headless_mode, lean_mode, admission, portal):
+    """Reads every passport, then registers the batch; all output goes through the `ui` channel.
+    Returns "failed" when the batch stopped before every guest was handled."""
+    # Keyed by upload position: phone uploads often share a name such as image.jpg
+    guest_keys = [f"{i+1}. {name}" for i, (name, _) in enumerate(files)]
+    for key in guest_keys:
+        ui.update_guest(key, "queued")
+    
+    all_extracted_data = []
+    for key, (name, image_bytes) in zip(guest_keys, files):
+        ui.check_cancelled()
+        try:
+            ui.write(f"Reading {name}...")
+            ui.update_guest(key, "reading")
+            ui.set_status("👀 Reading passports...")
+            # Only cloud backends take a shared AI slot; the local MRZ reader runs right away
+            data = extract_passport_data(
+                ui, image_bytes, api_key, use_local_mrz,
+                network_slot=lambda: admission.llm_slot(on_wait=queue_status_callback(ui, "an AI slot")),
+            )
+            data["file"] = name
+            data["guest_key"] = key
+            all_extracted_data.append(data)
+            ui.update_guest(key, "read", f"{data.get('full_name', '')} ({data['confidence']:.0%})")
+            record_to_ledger(ui, "extracted", outcome="read", listing=listing_name, arrival_date=arrival_date_str, departure_date=departure_date_str, **guest_ledger_fields(data))
+        except Exception as e:
+            ui.error(f"Error reading {name}: {e}")
+            record_to_ledger(ui, "extracted", outcome="failed", detail=str(e)[:500], listing=listing_name, arrival_date=arrival_date_str, departure_date=departure_date_str, source_file=name)
+            ui.update_guest(key, "failed", f"Read failed: {e}")
+    
+    if not all_extracted_data:
+        ui.set_status("❌ No passport could be read.")
+        return "failed"
+    ui.set_result("extracted", all_extracted_data)
+    
+    # Pause while the portal is degraded instead of burning timeouts
+    def on_portal_wait(retry_in, detail):
+        ui.check_cancelled()
+        ui.set_status(f"⏸ Portal looks degraded ({detail}). Batch paused, retrying in {retry_in}s...")
+    
+    if not portal.wait_until_healthy(on_wait=on_portal_wait, check=ui.check_cancelled):
+        ui.error("❌ The portal stayed unavailable. Please try this batch again later.")
+        ui.set_status("❌ Portal unavailable")
+        for data in all_extracted_data:
+            ui.update_guest(data["guest_key"], "skipped", "Portal unavailable")
+            record_to_ledger(ui, "submitted", outcome="skipped", detail="Portal unavailable", listing=listing_name, arrival_date=arrival_date_str, departure_date=departure_date_str, **guest_ledger_fields(data))
+        return "failed"
+    
+    # Run Bot for the whole list (once a browser slot is free)
+    with admission.browser_slot(on_wait=queue_status_callback(ui, "a browser")) as browser_slot:
+        ui.set_status("🤖 Registering guests on the portal...")
+        stop_reason = run_automation(ui, all_extracted_data, credentials['username'], credentials['password'], arrival_date_str, departure_date_str, listing_name, headless_mode, lean_mode, browser_slot, portal)
+    if stop_reason:
+        ui.set_status(f"⚠️ Batch stopped: {stop_reason}")
+        return "failed"
+    ui.set_status("🏁 Batch complete")
+
+def render_batch_log(channel, limit=None):
+    """Replays the worker's st-style events"""
+    events = channel.log[-limit:] if limit else channel.log
+    for event in events:
+        if event["kind"] == "image":
+            if os.path.exists(event["body"]):
+                st.image(event["body"], caption=event.get("caption"))
+        else:
+            getattr(st, event["kind"])(event["body"])
+
+def render_batch_summary(channel):
+    """Compact per-guest status, progress and cancel control"""
+    stages = channel.guests
+    done = sum(1 for g in stages.values() if g["stage"] in ("saved", "failed", "skipped"))
+    st.progress(done / len(stages) if stages else 0.0)
+    if channel.status_line:
+        st.caption(channel.status_line)
+    st.dataframe(
+        [{"Guest": key, "Stage": g["stage"], "Detail": g["detail"]} for key, g in stages.items()],
+        hide_index=True,
+    )
+    if "extracted" in channel.results:
+        with st.expander("✅ Extracted Data Overview"):
+            st.dataframe(channel.results["extracted"])
+
+@st.fragment(run_every=1)
+def render_running_batch():
+    """Polls the background batch once a second without rerunning the whole page"""
+    channel = st.session_state["batch"]
+    channel.poll()
+    if not channel.running:
+        st.rerun() # Switch to the static final view
+    
+    st.subheader(f"⚙️ Batch running ({int(time.time() - channel.started_at)}s)")
+    render_batch_summary(channel)
+    if channel.cancel_requested:
+        st.caption("🛑 Cancelling after the current step...")
+    elif st.button("🛑 Cancel Batch"):
+        channel.cancel()
+    with st.expander("📜 Live Log"):
+        render_batch_log(channel, limit=30)
+
+# --- 4. THE APP INTERFACE ---
 st.title("🛂 Da Nang Guest Registration Bot")
 st.write("Upload a passport photo to auto-fill the police declaration.")
 
@@ -729,6 +935,30 @@ st.write("Upload a passport photo to auto-fill the police declaration.")
 st.sidebar.header("🛠 Configuration")
 api_key = DEFAULT_API_KEY # Hidden from users, loaded automatically
 use_headless = st.sidebar.checkbox("👻 Run in Headless Mode", value=True, help="Uncheck to see the browser window popup locally.")
+# Off by default: enable only after benchmark_mrz.py shows confident reads are precise on this server
+use_local_mrz = st.sidebar.checkbox("🔍 Local MRZ Reader First", value=False, help="Reads the passport's machine readable zone on this server; cloud AI is only used when it isn't confident.")
+use_lean = st.sidebar.checkbox("⚡ Lean Browser Mode", value=False, help="Blocks images, fonts and trackers, uses eager page loads and keeps a persistent browser cache.")
+
+admission = get_admission_controller()
+server_status = admission.status()
+st.sidebar.caption(
+    f"🖥 Server load: {server_status['browsers']['active']}/{server_status['browsers']['capacity']} browsers "
+    f"({server_status['browsers']['queued']} queued), "
+    f"{server_status['llm']['active']}/{server_status['llm']['capacity']} AI requests"
+    + (f", {server_status['free_memory_mb']:.0f} MB free" if server_status['free_memory_mb'] is not None else "")
+)
+
+portal = get_portal_monitor()
+portal_status = portal.status()
+if portal_status['breaker'] == "open":
+    st.sidebar.caption(f"🌐 Portal: degraded, retrying in {portal_status['retry_after_s']}s")
+elif portal_status['last_probe']:
+    st.sidebar.caption(f"🌐 Portal: {'healthy' if portal_status['last_probe']['healthy'] else 'slow'} ({portal_status['last_probe']['latency_s']}s)")
+
+metrics_summary = summarize_page_metrics()
+if metrics_summary:
+    with st.sidebar.expander("⏱ Page Load: Lean On vs Off"):
+        st.dataframe(metrics_summary)
 
 st.sidebar.divider()
 st.sidebar.subheader("🏠 Listing Settings")
@@ -750,29 +980,60 @@ st.sidebar.info(f"**Arrival:** {str_arrival}\n\n**Departure:** {str_departure}")
 # File Uploader
 uploaded_files = st.file_uploader("Choose passport images...", type=["jpg", "png", "jpeg"], accept_multiple_files=True)
 
+batch = st.session_state.get("batch")
+batch_running = batch is not None and batch.running
+
 if uploaded_files and api_key:
     # Show the images in a grid or carousel
     st.write(f"📂 {len(uploaded_files)} files uploaded.")
     
-    if st.button("🚀 Extract & Register Batch"):
-        all_extracted_data = []
-        progress_bar = st.progress(0)
-        
-        with st.spinner("👀 Reading all passports..."):
-            for i, file in enumerate(uploaded_files):
-                try:
-                    st.write(f"Reading {file.name}...")
-                    data = extract_passport_data(file, api_key)
-                    all_extracted_data.append(data)
-                    progress_bar.progress((i + 1) / len(uploaded_files))
-                except Exception as e:
-                    st.error(f"Error reading {file.name}: {e}")
-            
-            if all_extracted_data:
-                st.write("### ✅ Extracted Data Overview")
-                st.dataframe(all_extracted_data)
-                
-                # Step 2: Run Bot for the whole list
-                run_automation(all_extracted_data, credentials['username'], credentials['password'], str_arrival, str_departure, selected_listing, use_headless)
+    if st.button("🚀 Extract & Register Batch", disabled=batch_running):
+        # Copy the uploads now; the worker must not depend on this script run
+        files = [(file.name, file.getvalue()) for file in uploaded_files]
+        _, batch = start_batch(
+            process_batch, files, api_key, use_local_mrz, credentials, str_arrival, str_departure,
+            selected_listing, use_headless, use_lean, admission, portal,
+        )
+        st.session_state["batch"] = batch
+        batch_running = True
 elif not api_key:
     st.warning("⚠️ API Key not found. Please ensure it is configured in your Streamlit Cloud Secrets.")
+
+if batch is not None:
+    st.divider()
+    if batch_running:
+        render_running_batch()
+    else:
+        batch.poll()
+        st.subheader(f"📋 Last Batch: {batch.state}")
+        render_batch_summary(batch)
+        render_batch_log(batch)
+
+# --- 5. THE LEDGER (registration history) ---
+st.divider()
+with st.expander("📒 Registration Ledger"):
+    col_passport, col_listing = st.columns(2)
+    ledger_passport = col_passport.text_input("Passport number")
+    ledger_listing = col_listing.selectbox("Listing", options=["All"] + ledger.listings())
+    col_from, col_to = st.columns(2)
+    ledger_from = col_from.date_input("Arrival from", value=datetime.date.today() - datetime.timedelta(days=30))
+    ledger_to = col_to.date_input("Arrival to", value=datetime.date.today())
+    ledger_event = st.radio("Show", options=["submitted", "extracted", "screenshot", "all"], horizontal=True)
+    
+    ledger_filters = {
+        "passport_number": ledger_passport.strip() or None,
+        "listing": None if ledger_listing == "All" else ledger_listing,
+        # A passport lookup searches the whole history
+        "date_from": None if ledger_passport.strip() else ledger_from,
+        "date_to": None if ledger_passport.strip() else ledger_to,
+        "event": None if ledger_event == "all" else ledger_event,
+    }
+    ledger_total, ledger_rows = ledger.query(limit=500, **ledger_filters)
+    st.caption(f"{ledger_total} matching rows" + (" (showing newest 500)" if ledger_total > 500 else ""))
+    st.dataframe(ledger_rows, hide_index=True)
+    
+    if ledger_total and st.button("📤 Prepare CSV export"):
+        st.download_button(
+            "⬇️ Download CSV", data=ledger.export_csv(**ledger_filters),
+            file_name=f"ledger_{datetime.date.today().isoformat()}.csv", mime="text/csv",
+        )
@@ -0,0 +1,191 @@
+import re
+import datetime
+
+from nationality_index import NATIONALITY_ALIASES
+
+# Values of MRZ characters for the ICAO 9303 check digit
+_MRZ_WEIGHTS = (7, 3, 1)
+
+
+def mrz_char_value(char):
+    if char.isdigit():
+        return int(char)
+    if "A" <= char <= "Z":
+        return ord(char) - ord("A") + 10
+    return 0 # '<' filler (and anything unreadable)
+
+
+def mrz_check_digit(field):
+    """Computes the ICAO 9303 check digit of an MRZ field."""
+    total = sum(mrz_char_value(c) * _MRZ_WEIGHTS[i % 3] for i, c in enumerate(field))
+    return str(total % 10)
+
+
+def _mrz_date_to_ddmmyyyy(yymmdd, past_only=True):
+    """Converts an MRZ YYMMDD date to DD/MM/YYYY, resolving the century."""
+    try:
+        yy, mm, dd = int(yymmdd[0:2]), int(yymmdd[2:4]), int(yymmdd[4:6])
+    except ValueError:
+        return None
+    current_yy = datetime.date.today().year % 100
+    century = 1900 if past_only and yy > current_yy else 2000
+    try:
+        return datetime.date(century + yy, mm, dd).strftime("%d/%m/%Y")
+    except ValueError:
+        return None
+
+
+def parse_td3_mrz(line1, line2):
+    """
+    Parses the two 44-character lines of a passport (TD3) MRZ.
+    Returns a dict with the extracted fields and check-digit results, or None.
+    """
+    line1 = re.sub(r'\s', '', line1 or "").upper()
+    line2 = re.sub(r'\s', '', line2 or "").upper()
+    if len(line1) != 44 or len(line2) != 44 or not line1.startswith("P"):
+        return None
+
+    # Line 1: P<ISSUER SURNAME<<GIVEN<NAMES
+    names = line1[5:].split("<<", 1)
+    surname = names[0].replace("<", " ").strip()
+    given = names[1].replace("<", " ").strip() if len(names) > 1 else ""
+    full_name = re.sub(r'\s+', ' ', f"{surname} {given}").strip()
+
+    passport_number = line2[0:9]
+    dob = line2[13:19]
+    expiry = line2[21:27]
+    composite_field = line2[0:10] + line2[13:20] + line2[21:43]
+
+    return {
+        "full_name": full_name,
+        "passport_number": passport_number.replace("<", ""),
+        "nationality_code": line2[10:13].replace("<", ""),
+        "dob": _mrz_date_to_ddmmyyyy(dob),
+        "sex": line2[20] if line2[20] in "FM" else None,
+        "checks": {
+            "passport_number": mrz_check_digit(passport_number) == line2[9],
+            "dob": mrz_check_digit(dob) == line2[19],
+            "expiry": mrz_check_digit(expiry) == line2[27],
+            "composite": mrz_check_digit(composite_field) == line2[43],
+        },
+    }
+
+
+def _normalize_name(name):
+    name = re.sub(r'[^a-zA-Z\s]', '', name or "").upper()
+    return re.sub(r'\s+', ' ', name).strip()
+
+
+# A result that contradicts its own MRZ can never reach the cascade threshold
+MRZ_CONFLICT_CAP = 0.5
+# Printed fields alone can look right without being right; without an MRZ
+# a fully valid result is trusted, but less than an MRZ-confirmed one
+NO_MRZ_CAP = 0.9
+
+
+def score_extraction(data, valid_nationalities):
+    """
+    Scores an extraction result with local checks only (no network).
+    `valid_nationalities` is anything supporting `in` (a dict of codes or a NationalityIndex).
+    Returns (confidence between 0 and 1, list of failed check names).
+
+    Field format checks give the base score. A failed MRZ check digit or a
+    printed field that disagrees with the MRZ caps the result below
+    MRZ_CONFLICT_CAP; a result without a readable MRZ is capped at NO_MRZ_CAP.
+    """
+    checks = {}
+
+    name = _normalize_name(data.get("full_name"))
+    checks["full_name"] = len(name) >= 2
+
+    passport_number = str(data.get("passport_number") or "").replace(" ", "").upper()
+    checks["passport_number"] = bool(re.fullmatch(r'[A-Z0-9]{5,9}', passport_number))
+
+    nationality = str(data.get("nationality_code") or "").upper()
+    checks["nationality_code"] = nationality in valid_nationalities
+
+    try:
+        dob = datetime.datetime.strptime(str(data.get("dob") or ""), "%d/%m/%Y").date()
+        checks["dob"] = datetime.date(1900, 1, 1) <= dob <= datetime.date.today()
+    except ValueError:
+        checks["dob"] = False
+
+    checks["sex"] = data.get("sex") in ("F", "M")
+
+    failed = [check for check, ok in checks.items() if not ok]
+    confidence = 1 - len(failed) / len(checks)
+
+    # MRZ consistency: the printed fields must agree with a valid MRZ
+    mrz_lines = data.get("mrz") or []
+    mrz = parse_td3_mrz(*mrz_lines[:2]) if isinstance(mrz_lines, list) and len(mrz_lines) >= 2 else None
+    if mrz is None:
+        failed.append("mrz_present")
+        return round(confidence * NO_MRZ_CAP, 2), failed
+
+    mrz_checks = {
+        "mrz_passport_check_digit": mrz["checks"]["passport_number"],
+        "mrz_dob_check_digit": mrz["checks"]["dob"],
+        "mrz_composite_check_digit": mrz["checks"]["composite"],
+        "mrz_passport_match": mrz["passport_number"] == passport_number,
+        "mrz_dob_match": mrz["dob"] == data.get("dob"),
+        "mrz_sex_match": mrz["sex"] == data.get("sex"),
+        "mrz_nationality_match": same_nationality(mrz["nationality_code"], nationality, valid_nationalities),
+    }
+    mrz_failed = [check for check, ok in mrz_checks.items() if not ok]
+    if mrz_failed:
+        # Hard cap, still ordered by how much of the MRZ agrees
+        passed = 1 - len(mrz_failed) / len(mrz_checks)
+        confidence = min(confidence, MRZ_CONFLICT_CAP) * passed
+    return round(confidence, 2), failed + mrz_failed
+
+
+def _canonical_nationality(code, valid_nationalities):
+    """Maps an ISO or ICAO code to the portal's code; falls back to the alias table for plain sets."""
+    code = str(code or "").replace("<", "").upper()
+    resolve = getattr(valid_nationalities, "resolve", None)
+    if resolve is not None:
+        return resolve(code)
+    return NATIONALITY_ALIASES.get(code, code) or None
+
+
+def same_nationality(a, b, valid_nationalities):
+    """
+    True when both codes name the same nationality: MRZs carry ICAO codes
+    (D<< for Germany) while models tend to answer with the ISO code (DEU).
+    """
+    a = _canonical_nationality(a, valid_nationalities)
+    return a is not None and a == _canonical_nationality(b, valid_nationalities)
+
+
+# Line 1 after "P<ISS": SURNAME(<PART)*<<GIVEN(<NAMES)* then only fillers
+_TD3_NAME_FIELD = re.compile(r'[A-Z]+(<[A-Z]+)*(<<[A-Z]+(<[A-Z]+)*)?<*')
+
+
+def score_mrz_read(data, valid_nationalities):
+    """
+    Scores a result whose printed fields were filled from the MRZ itself
+    (the local OCR backend). Printed-vs-MRZ matches would pass by definition,
+    so only the check digits, the nationality and a line-1 name sanity check count.
+    Returns (confidence between 0 and 1, list of failed check names).
+    """
+    mrz_lines = data.get("mrz") or []
+    mrz = parse_td3_mrz(*mrz_lines[:2]) if isinstance(mrz_lines, list) and len(mrz_lines) >= 2 else None
+    if mrz is None:
+        return 0.0, ["mrz_present"]
+
+    line1 = re.sub(r'\s', '', mrz_lines[0]).upper()
+    checks = {
+        "mrz_passport_check_digit": mrz["checks"]["passport_number"],
+        "mrz_dob_check_digit": mrz["checks"]["dob"],
+        "mrz_expiry_check_digit": mrz["checks"]["expiry"],
+        "mrz_composite_check_digit": mrz["checks"]["composite"],
+        # The name is not covered by any check digit: digits or broken filler structure mean a misread
+        "mrz_name": bool(_TD3_NAME_FIELD.fullmatch(line1[5:])) and len(_normalize_name(mrz["full_name"])) >= 2,
+        "nationality_code": mrz["nationality_code"] in valid_nationalities,
+        "sex": mrz["sex"] in ("F", "M"),
+        "dob": mrz["dob"] is not None,
+    }
+    failed = [check for check, ok in checks.items() if not ok]
+    if failed:
+        return round(MRZ_CONFLICT_CAP * (1 - len(failed) / len(checks)), 2), failed
+    return 1.0, []
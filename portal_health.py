@@ -0,0 +1,198 @@
+import time
+import threading
+import urllib.request
+import urllib.error
+from collections import deque
+
+PORTAL_URL = "https://danang.xuatnhapcanh.gov.vn/faces/index.jsf"
+
+# Steps that submit data: a short timeout there can abandon a save the portal
+# already accepted and invite a duplicate registration, so they never adapt.
+WRITE_STEPS = {"save_button", "save_confirmation"}
+
+
+def probe_portal(url=PORTAL_URL, timeout_s=10):
+    """
+    Lightweight health check: fetches the first bytes of the portal's index page.
+    Returns (ok, latency_s, detail).
+    """
+    started = time.perf_counter()
+    try:
+        request = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0 (health probe)"})
+        with urllib.request.urlopen(request, timeout=timeout_s) as response:
+            response.read(1024)
+            status = response.status
+        latency = time.perf_counter() - started
+        return status < 500, round(latency, 2), f"HTTP {status}"
+    except urllib.error.HTTPError as e:
+        return e.code < 500, round(time.perf_counter() - started, 2), f"HTTP {e.code}"
+    except Exception as e:
+        return False, round(time.perf_counter() - started, 2), type(e).__name__
+
+
+class StepLatencyTracker:
+    """
+    Keeps the most recent durations of each automation step and derives a
+    timeout from them: a multiple of the recent p95, clamped to [min, max].
+    Samples are keyed by (step, lean_mode): eager lean page loads say nothing
+    about how long a full non-lean load takes. Write steps always get the ceiling.
+    """
+
+    def __init__(self, window=20, multiplier=3.0, floor_s=5, ceiling_s=30):
+        self.window = window
+        self.multiplier = multiplier
+        self.floor_s = floor_s
+        self.ceiling_s = ceiling_s
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, step, duration_s, lean_mode=False):
+        with self._lock:
+            self._samples.setdefault((step, lean_mode), deque(maxlen=self.window)).append(duration_s)
+
+    def p95(self, step, lean_mode=False):
+        with self._lock:
+            samples = sorted(self._samples.get((step, lean_mode), ()))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def timeout_for(self, step, lean_mode=False):
+        """Adaptive timeout; the ceiling for write steps and until the step has been observed a few times."""
+        if step in WRITE_STEPS:
+            return self.ceiling_s
+        with self._lock:
+            count = len(self._samples.get((step, lean_mode), ()))
+        if count < 3:
+            return self.ceiling_s
+        return round(min(self.ceiling_s, max(self.floor_s, self.p95(step, lean_mode) * self.multiplier + 2)), 1)
+
+
+class CircuitBreaker:
+    """
+    Classic closed -> open -> half-open breaker.
+    Opens after `failure_threshold` consecutive failures. After `cooldown_s`
+    it hands a single trial token to the first caller of `allow()`; everyone
+    else is refused until that trial succeeds or fails. A trial that never
+    reports back expires after another `cooldown_s`.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=3, cooldown_s=60):
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.time() - self._opened_at >= self.cooldown_s:
+                self._state = self.HALF_OPEN
+            return self._state
+
+    def _trial_pending(self):
+        return self._trial_started_at is not None and time.time() - self._trial_started_at < self.cooldown_s
+
+    def allow(self):
+        """True when closed; in half-open, True only for the caller that takes the trial token."""
+        state = self.state
+        with self._lock:
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_pending():
+                self._trial_started_at = time.time()
+                return True
+            return False
+
+    def retry_after_s(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._trial_pending():
+                return max(0, round(self.cooldown_s - (time.time() - self._trial_started_at)))
+            if self._state != self.OPEN:
+                return 0
+            return max(0, round(self.cooldown_s - (time.time() - self._opened_at)))
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.time()
+            self._trial_started_at = None
+
+
+class PortalMonitor:
+    """
+    Process-wide view of the portal's health: probe results, step latencies
+    and the circuit breaker shared by every batch on this server.
+    """
+
+    def __init__(self, url=PORTAL_URL, degraded_latency_s=8, failure_threshold=3, cooldown_s=60):
+        self.url = url
+        self.degraded_latency_s = degraded_latency_s
+        self.latencies = StepLatencyTracker()
+        self.breaker = CircuitBreaker(failure_threshold, cooldown_s)
+        self.last_probe = None
+
+    def probe(self):
+        """Runs a health probe and feeds the result into the breaker."""
+        ok, latency, detail = probe_portal(self.url, timeout_s=self.degraded_latency_s * 2)
+        healthy = ok and latency <= self.degraded_latency_s
+        self.last_probe = {"healthy": healthy, "latency_s": latency, "detail": detail, "at": int(time.time())}
+        if healthy:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        return healthy
+
+    def timeout_for(self, step, lean_mode=False):
+        return self.latencies.timeout_for(step, lean_mode)
+
+    def record_step(self, step, duration_s, lean_mode=False):
+        self.latencies.record(step, duration_s, lean_mode)
+        self.breaker.record_success()
+
+    def record_timeout(self, step):
+        self.breaker.record_failure()
+
+    def wait_until_healthy(self, on_wait=None, check=None, max_wait_s=900, poll_s=15):
+        """
+        Blocks a queued batch while the portal is degraded, re-probing until it recovers.
+        `on_wait(retry_in_s, detail)` is called before each pause; `check()` is called
+        every second during it and may raise to abort (e.g. on cancel). Returns False on giving up.
+        """
+        deadline = time.time() + max_wait_s
+        while True:
+            if self.breaker.allow() and self.probe():
+                return True
+            if time.time() >= deadline:
+                return False
+            retry_in = max(poll_s, self.breaker.retry_after_s())
+            if on_wait:
+                detail = self.last_probe["detail"] if self.last_probe else "circuit open"
+                on_wait(retry_in, detail)
+            resume_at = min(time.time() + retry_in, deadline)
+            while time.time() < resume_at:
+                if check:
+                    check()
+                time.sleep(min(1, max(0, resume_at - time.time())))
+
+    def status(self):
+        return {
+            "breaker": self.breaker.state,
+            "retry_after_s": self.breaker.retry_after_s(),
+            "last_probe": self.last_probe,
+        }